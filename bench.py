@@ -0,0 +1,223 @@
+"""Reproducible Sortify benchmarks: a seeded synthetic image corpus and per-stage timings.
+
+    python cli.py bench --output results.json
+    python cli.py bench --compare results.json
+
+The corpus is generated from a seed, so the same seed always produces the same images and
+descriptions and results from different versions of the code can be compared directly.
+"""
+import json
+import os
+import platform
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import persistence
+from classifier import classify_with_opencv, extract_features, load_image, score_features
+
+# ---- SYNTHETIC CORPUS ----
+
+# each profile: HSV colours (OpenCV ranges, H 0-179) for the background and blobs, and the descriptions
+# its images are paired with. Colours sit inside the classifier's masks so every feature gets exercised.
+CORPUS_PROFILES = {
+    "organic": {
+        "background": [(20, 120, 90), (45, 140, 110)],
+        "blobs": [(50, 200, 150), (60, 160, 120), (15, 150, 130), (25, 200, 200)],
+        "descriptions": ["banana peel", "rotten apple", "leaves", "vegetable scraps", "old bread", ""],
+    },
+    "plastic": {
+        "background": [(0, 10, 230), (110, 30, 220)],
+        "blobs": [(105, 200, 200), (115, 150, 230), (0, 0, 250), (95, 120, 180)],
+        "descriptions": ["plastic bottle", "clean glass jar", "tupperware container", "cardboard box", ""],
+    },
+    "trash": {
+        "background": [(0, 0, 20), (0, 20, 60)],
+        "blobs": [(0, 10, 120), (0, 0, 10), (10, 30, 90), (0, 20, 160)],
+        "descriptions": ["dirty wrapper", "broken toy", "burnt pan", "contaminated tissue", ""],
+    },
+}
+
+# (width, height), cycled through so every profile appears at every size
+CORPUS_SIZES = [(320, 240), (800, 600), (1600, 1200), (4000, 3000)]
+CORPUS_MANIFEST = "manifest.json"
+
+
+def _bgr(hsv):
+    return tuple(int(v) for v in cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)[0, 0])
+
+def synthetic_image(rng, profile, size):
+    """One image: a background colour, random blobs in the profile's colours and some sensor-like noise"""
+    width, height = size
+    spec = CORPUS_PROFILES[profile]
+    background = spec["background"][rng.integers(len(spec["background"]))]
+    img = np.empty((height, width, 3), np.uint8)
+    img[:] = _bgr(background)
+
+    for _ in range(int(rng.integers(6, 16))):
+        colour = _bgr(spec["blobs"][rng.integers(len(spec["blobs"]))])
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        axes = (int(rng.integers(width // 20, width // 4)), int(rng.integers(height // 20, height // 4)))
+        cv2.ellipse(img, center, axes, float(rng.integers(180)), 0, 360, colour, -1)
+
+    noise = rng.normal(0, 8, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+def generate_corpus(out_dir, count=48, seed=0):
+    """Write count images into out_dir and return the manifest [{path, profile, size, description}, ...]"""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    profiles = list(CORPUS_PROFILES)
+    manifest = []
+    for i in range(count):
+        profile = profiles[i % len(profiles)]
+        size = CORPUS_SIZES[(i // len(profiles)) % len(CORPUS_SIZES)]
+        descriptions = CORPUS_PROFILES[profile]["descriptions"]
+        description = descriptions[rng.integers(len(descriptions))]
+        # mostly JPEG like phone photos, every fourth one PNG so both decoders are timed
+        ext = "png" if i % 4 == 3 else "jpg"
+        name = f"{i:04d}_{profile}_{size[0]}x{size[1]}.{ext}"
+        params = [cv2.IMWRITE_JPEG_QUALITY, 90] if ext == "jpg" else []
+        cv2.imwrite(os.path.join(out_dir, name), synthetic_image(rng, profile, size), params)
+        manifest.append({"path": name, "profile": profile, "size": list(size), "description": description})
+
+    with open(os.path.join(out_dir, CORPUS_MANIFEST), "w") as f:
+        json.dump({"seed": seed, "count": count, "images": manifest}, f, indent=1)
+    return manifest
+
+def load_corpus(out_dir, count=48, seed=0):
+    """Reuse the corpus in out_dir if it was generated with the same seed and count, otherwise regenerate it"""
+    try:
+        with open(os.path.join(out_dir, CORPUS_MANIFEST)) as f:
+            existing = json.load(f)
+        if existing["seed"] == seed and existing["count"] == count:
+            return existing["images"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return generate_corpus(out_dir, count, seed)
+
+
+# ---- TIMING ----
+
+def summarize(samples, items_per_sample=1):
+    """Latency percentiles (ms) and throughput (items/s) for a list of per-call durations in seconds"""
+    samples = np.asarray(samples, dtype=np.float64)
+    total = float(samples.sum())
+    return {
+        "n": int(samples.size),
+        "total_s": round(total, 6),
+        "throughput_per_s": round(samples.size * items_per_sample / total, 2) if total > 0 else None,
+        "mean_ms": round(float(samples.mean()) * 1000, 4),
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 4),
+    }
+
+def _time_calls(fn, args_list, repeat):
+    samples = []
+    for _ in range(repeat):
+        for args in args_list:
+            start = time.perf_counter()
+            fn(*args)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_classifier(corpus_dir, manifest, repeat=3):
+    paths = [os.path.join(corpus_dir, item["path"]) for item in manifest]
+    descriptions = [item["description"] for item in manifest]
+
+    # one untimed pass so first-call costs (codec setup, page faults) don't land in the samples
+    images = [load_image(path) for path in paths]
+    features = [extract_features(img) for img in images]
+
+    return {
+        "decode": summarize(_time_calls(load_image, [(p,) for p in paths], repeat)),
+        "features": summarize(_time_calls(extract_features, [(img,) for img in images], repeat)),
+        "scoring": summarize(_time_calls(score_features, list(zip(features, descriptions)), repeat)),
+        "classify_end_to_end": summarize(_time_calls(classify_with_opencv, list(zip(paths, descriptions)), repeat)),
+    }
+
+def bench_database(rows=2000, batch=100, users=50):
+    """history and eco_points writes against a fresh database in a temporary folder"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = persistence.init_db(path)
+        now = time.time()
+
+        # one transaction per row, what a direct INSERT + commit per classification costs
+        history_rows = [(f"user{i % users}", "Trash", f"item{i}.jpg", now) for i in range(rows)]
+        samples = []
+        for row in history_rows:
+            start = time.perf_counter()
+            db.execute(persistence.HISTORY_INSERT, row)
+            db.commit()
+            samples.append(time.perf_counter() - start)
+        history_single = summarize(samples)
+
+        samples = []
+        for i in range(rows):
+            start = time.perf_counter()
+            persistence.add_points(db, f"user{i % users}", 3)
+            samples.append(time.perf_counter() - start)
+        eco_points = summarize(samples)
+        db.close()
+
+        # group-committed through the write-behind queue, one sample per batch of rows
+        samples = []
+        with persistence.WriteBehindWriter(path, max_batch=batch) as writer:
+            for first in range(0, rows, batch):
+                start = time.perf_counter()
+                for i in range(first, min(first + batch, rows)):
+                    writer.insert_history(f"user{i % users}", "Trash", f"item{i}.jpg")
+                writer.flush()
+                samples.append(time.perf_counter() - start)
+        history_batched = summarize(samples, items_per_sample=batch)
+
+    return {"history_insert": history_single, "history_write_behind": history_batched, "eco_points_add": eco_points}
+
+
+def run_suite(corpus_dir, count=48, seed=0, repeat=3, db_rows=2000, label=None):
+    manifest = load_corpus(corpus_dir, count, seed)
+    stages = bench_classifier(corpus_dir, manifest, repeat)
+    stages.update(bench_database(db_rows))
+    return {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+        },
+        "corpus": {"seed": seed, "count": count, "sizes": CORPUS_SIZES, "profiles": list(CORPUS_PROFILES)},
+        "repeat": repeat,
+        "stages": stages,
+    }
+
+
+# ---- REPORTING ----
+
+def print_results(results):
+    print(f"{'stage':<22}{'n':>7}{'items/s':>12}{'p50 ms':>11}{'p99 ms':>11}")
+    for stage, s in results["stages"].items():
+        print(f"{stage:<22}{s['n']:>7}{s['throughput_per_s'] or 0:>12.1f}{s['p50_ms']:>11.3f}{s['p99_ms']:>11.3f}")
+
+def compare_results(baseline, current, threshold=0.20):
+    """Print p50/p99 changes per stage and return the stages that got slower by more than threshold"""
+    regressions = []
+    for stage, now in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if not before:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p99_ms"):
+            if before[metric] > 0:
+                change = now[metric] / before[metric] - 1
+                changes.append(f"{metric[:3]} {change:+.1%}")
+                if metric == "p50_ms" and change > threshold:
+                    regressions.append(stage)
+        print(f"{stage:<22}{', '.join(changes)}{'  REGRESSION' if stage in regressions else ''}")
+    return regressions
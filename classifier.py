@@ -0,0 +1,969 @@
+"""Sortify classification core: feature extraction, scoring rules, batch/cascade classifiers and the result cache.
+
+Importing this module has no side effects, no GUI toolkit is loaded and no database is opened.
+"""
+import os
+import io
+import time
+import hashlib
+import json
+import operator
+import re
+import signal
+from collections import OrderedDict
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+# ---- FEATURE EXTRACTION ----
+
+# (lower, upper) HSV bounds for each colour mask, same ranges the classifier always used
+COLOR_RANGES = {
+    "green": ((30, 40, 40), (85, 255, 255)),
+    "yellow": ((15, 60, 60), (35, 255, 255)),
+    "blue": ((90, 60, 60), (130, 255, 255)),
+    "brown": ((5, 40, 40), (25, 200, 200)),
+    "black": ((0, 0, 0), (180, 255, 40)),
+    "grey": ((0, 0, 40), (180, 40, 180)),
+}
+COLOR_BITS = {name: 1 << i for i, name in enumerate(COLOR_RANGES)}
+CODE_BINS = 1 << len(COLOR_RANGES)
+WHITE_THRESHOLD = 200
+
+
+class ImageFeatures(NamedTuple):
+    green_ratio: float
+    yellow_ratio: float
+    blue_ratio: float
+    brown_ratio: float
+    black_ratio: float
+    grey_ratio: float
+    white_ratio: float
+    edge_ratio: float
+    texture_variance: float
+    brightness_std: float
+
+
+def _build_channel_luts():
+    # each HSV range is a box, so a pixel is inside it exactly when every channel is inside
+    # its own interval. One lookup table per channel sets the colour bits that channel allows,
+    # and AND-ing the three lookups gives every colour mask at once.
+    values = np.arange(256)
+    luts = np.zeros((3, 256), dtype=np.uint8)
+    for name, (lower, upper) in COLOR_RANGES.items():
+        for ch in range(3):
+            inside = (values >= lower[ch]) & (values <= upper[ch])
+            luts[ch, inside] |= COLOR_BITS[name]
+    return np.ascontiguousarray(luts.T).reshape(256, 1, 3)
+
+HSV_LUT = _build_channel_luts()
+# for every colour bit, which of the CODE_BINS histogram bins have it set
+_CODE_MEMBERS = {name: (np.arange(CODE_BINS) & bit) != 0 for name, bit in COLOR_BITS.items()}
+_LEVELS = np.arange(256, dtype=np.float64)
+
+
+def _hist(img, bins, channel=0):
+    return cv2.calcHist([img], [channel], None, [bins], [0, bins]).ravel()
+
+
+def _hist_std(hist, n):
+    # works on a single 256-bin histogram or an (N, 256) stack of them
+    hist = np.asarray(hist, dtype=np.float64)
+    mean = (hist * _LEVELS).sum(axis=-1, keepdims=True) / n
+    return np.sqrt((hist * (_LEVELS - mean) ** 2).sum(axis=-1) / n)
+
+
+def extract_features(img, timer=None):
+    """Compute every colour ratio and statistic for a resized BGR image in a single sweep"""
+    n = img.shape[0] * img.shape[1]
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if timer:
+        timer.lap("convert")
+
+    # one table lookup over the HSV image, then fold the three channel codes together
+    h_bits, s_bits, v_bits = cv2.split(cv2.LUT(hsv, HSV_LUT))
+    code = cv2.bitwise_and(cv2.bitwise_and(h_bits, s_bits), v_bits)
+
+    # a single histogram of the combined codes gives all six mask counts
+    code_hist = _hist(code, CODE_BINS)
+    ratios = {name: float(code_hist[members].sum()) / n for name, members in _CODE_MEMBERS.items()}
+    if timer:
+        timer.lap("masks")
+
+    # white ratio and the standard deviations come from 256-bin histograms
+    # instead of separate threshold and float passes over the image
+    gray_hist = _hist(gray, 256)
+    value_hist = _hist(hsv, 256, channel=2)
+    ratios["white"] = float(gray_hist[WHITE_THRESHOLD + 1:].sum()) / n
+    if timer:
+        timer.lap("histograms")
+
+    edges = cv2.Canny(gray, 100, 200)
+    edge_ratio = cv2.countNonZero(edges) / n
+    if timer:
+        timer.lap("canny")
+
+    features = ImageFeatures(
+        green_ratio=ratios["green"],
+        yellow_ratio=ratios["yellow"],
+        blue_ratio=ratios["blue"],
+        brown_ratio=ratios["brown"],
+        black_ratio=ratios["black"],
+        grey_ratio=ratios["grey"],
+        white_ratio=ratios["white"],
+        edge_ratio=edge_ratio,
+        texture_variance=float(_hist_std(gray_hist, n)),
+        brightness_std=float(_hist_std(value_hist, n)),
+    )
+    if timer:
+        timer.lap("std")
+    return features
+
+
+def extract_features_batch(stack):
+    """Vectorized extract_features over an (N, H, W, 3) BGR stack, every field becomes a length N array"""
+    count, height, width = stack.shape[:3]
+    n = height * width
+
+    # cv2 colour conversions and lookups are per pixel, so the stack can go through as one tall image
+    tall = stack.reshape(count * height, width, 3)
+    hsv = cv2.cvtColor(tall, cv2.COLOR_BGR2HSV)
+    gray = cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY)
+    h_bits, s_bits, v_bits = cv2.split(cv2.LUT(hsv, HSV_LUT))
+    code = cv2.bitwise_and(cv2.bitwise_and(h_bits, s_bits), v_bits)
+
+    code_hist = _batch_hist(code.reshape(count, n), CODE_BINS)
+    gray_hist = _batch_hist(gray.reshape(count, n), 256)
+    value_hist = _batch_hist(hsv[:, :, 2].reshape(count, n), 256)
+    ratios = {name: code_hist[:, members].sum(axis=1) / n for name, members in _CODE_MEMBERS.items()}
+    ratios["white"] = gray_hist[:, WHITE_THRESHOLD + 1:].sum(axis=1) / n
+
+    # Canny looks at neighbouring pixels, so it has to run per image to keep borders exact
+    gray = gray.reshape(count, height, width)
+    edges = np.stack([cv2.Canny(g, 100, 200) for g in gray])
+    edge_ratio = np.count_nonzero(edges.reshape(count, n), axis=1) / n
+
+    return ImageFeatures(
+        green_ratio=ratios["green"],
+        yellow_ratio=ratios["yellow"],
+        blue_ratio=ratios["blue"],
+        brown_ratio=ratios["brown"],
+        black_ratio=ratios["black"],
+        grey_ratio=ratios["grey"],
+        white_ratio=ratios["white"],
+        edge_ratio=edge_ratio,
+        texture_variance=_hist_std(gray_hist, n),
+        brightness_std=_hist_std(value_hist, n),
+    )
+
+
+def _batch_hist(values, bins):
+    # calcHist per image beats any single numpy pass (bincount needs int64 offsets over the whole stack)
+    return np.stack([_hist(row, bins) for row in values]).astype(np.int64)
+
+
+# ---- SCORING ----
+
+CATEGORIES = ["Recyclable", "Reusable", "Compostable", "Trash"]
+
+CATEGORY_KEYWORDS = {
+    "Compostable": ["moldy", "food", "organic", "banana", "apple", "leaves", "compost", "rotten", "vegetable", "fruit", "bread"],
+    "Recyclable": ["plastic", "glass", "metal", "paper", "cardboard", "can"],
+    "Reusable": ["container", "tupperware", "box", "jar", "bottle", "good condition", "clean"],
+    "Trash": ["dirty", "broken", "damaged", "burnt", "contaminated"],
+}
+
+def _normalize_keyword(word):
+    return " ".join(word.lower().split())
+
+def _plural(word):
+    # regular English plural of the last word: boxes, glasses, berries, bottles. Irregular plurals
+    # (leaves, knives) go in the vocabulary as keywords of their own
+    if word.endswith(("s", "x", "z", "ch", "sh")):
+        return word + "es"
+    if word.endswith("y") and len(word) > 1 and word[-2] not in "aeiou ":
+        return word[:-1] + "ies"
+    return word + "s"
+
+def _trie_pattern(words):
+    # factor shared prefixes into a trie so the regex engine never retries the same prefix,
+    # this keeps matching fast even with tens of thousands of keywords
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def emit(node):
+        end = "" in node
+        branches = [(r"\s+" if ch == " " else re.escape(ch)) + emit(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end:
+            # alternation is ordered, so a longer keyword is preferred over its own prefix
+            body = "(?:" + body + ")?"
+        return body
+
+    return emit(trie)
+
+
+class KeywordMatcher:
+    """All category keywords compiled into one word-boundary regex, one scan finds every category hit"""
+
+    def __init__(self, category_keywords):
+        # the vocabulary as given, so pool processes can rebuild the same matcher
+        self.source = {category: list(words) for category, words in category_keywords.items()}
+        self.categories = {}
+        for category, words in category_keywords.items():
+            for word in words:
+                word = _normalize_keyword(word)
+                if word:
+                    # each keyword's own plural goes into the trie as well, so "cans" hits but neither
+                    # "scan" nor "canes" does
+                    for form in (word, _plural(word)):
+                        self.categories.setdefault(form, set()).add(category)
+
+        self.pattern = re.compile(r"\b(" + _trie_pattern(self.categories) + r")\b")
+        vocab = json.dumps(sorted((w, sorted(cats)) for w, cats in self.categories.items()))
+        self.fingerprint = hashlib.blake2b(vocab.encode(), digest_size=6).hexdigest()
+
+    def hits(self, description):
+        found = set()
+        for match in self.pattern.finditer(description.lower()):
+            found |= self.categories[_normalize_keyword(match.group(1))]
+        return found
+
+    @classmethod
+    def from_file(cls, path):
+        # JSON file shaped like CATEGORY_KEYWORDS: {"Compostable": ["banana", ...], ...}
+        with open(path, encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        unknown = set(vocabulary) - set(CATEGORIES)
+        if unknown:
+            raise ValueError(f"unknown categories in {path}: {', '.join(sorted(unknown))}")
+        return cls(vocabulary)
+
+
+keyword_matcher = KeywordMatcher(CATEGORY_KEYWORDS)
+
+def load_keywords(path):
+    """Replace the built-in keyword lists with the vocabulary in a JSON file"""
+    global keyword_matcher
+    keyword_matcher = KeywordMatcher.from_file(path)
+    return keyword_matcher
+
+def keyword_hits(description):
+    found = keyword_matcher.hits(description)
+    return {category: category in found for category in CATEGORIES}
+
+
+KEYWORD_SCORE = 100
+BASE_SCORE = 5
+
+# The image rules as data. A rule adds weight to its category when all of its conditions hold ("all")
+# or any of them does ("any"). A condition is (feature, comparator, threshold), where feature is an
+# ImageFeatures field or a sum of them written "a+b". "else_of" only lets a rule fire when the named
+# earlier rule didn't (an elif). Threshold search tunes these numbers, the structure stays here.
+IMAGE_RULES = [
+    # --- Trash detection ---
+    {"name": "trash_dark", "category": "Trash", "weight": 50,
+     "any": [("black_ratio", ">", 0.1), ("grey_ratio", ">", 0.18)]},
+    {"name": "trash_dark_no_organics", "category": "Trash", "weight": 40, "else_of": "trash_dark",
+     "all": [("black_ratio", ">", 0.07), ("green_ratio+yellow_ratio+brown_ratio", "<", 0.08)]},
+    {"name": "trash_contrast", "category": "Trash", "weight": 25,
+     "all": [("brightness_std", ">", 60), ("black_ratio+grey_ratio", ">", 0.15)]},
+
+    # --- Compostable detection ---
+    {"name": "compost_colour", "category": "Compostable", "weight": 40,
+     "any": [("green_ratio", ">", 0.12), ("yellow_ratio", ">", 0.12), ("brown_ratio", ">", 0.1)]},
+    {"name": "compost_texture", "category": "Compostable", "weight": 20,
+     "all": [("texture_variance", ">", 20), ("texture_variance", "<", 60)]},
+
+    # --- Recyclable detection ---
+    {"name": "recycle_blue", "category": "Recyclable", "weight": 35, "all": [("blue_ratio", ">", 0.08)]},
+    {"name": "recycle_white", "category": "Recyclable", "weight": 30,
+     "all": [("white_ratio", ">", 0.15), ("texture_variance", "<", 55)]},
+    {"name": "recycle_edges", "category": "Recyclable", "weight": 20,
+     "all": [("edge_ratio", ">", 0.18), ("texture_variance", "<", 65)]},
+
+    # --- Reusable detection ---
+    {"name": "reuse_edges", "category": "Reusable", "weight": 35,
+     "all": [("edge_ratio", ">", 0.25), ("texture_variance", "<", 40), ("black_ratio", "<", 0.08)]},
+    {"name": "reuse_white", "category": "Reusable", "weight": 25,
+     "all": [("white_ratio", ">", 0.2), ("texture_variance", "<", 35)]},
+    {"name": "reuse_brown", "category": "Reusable", "weight": 15,
+     "all": [("brown_ratio", ">", 0.08), ("texture_variance", "<", 45)]},
+]
+
+# applied after every rule: when if_greater outscores category, category gets weight added (not below floor)
+SCORE_ADJUSTMENTS = [
+    # organic-looking images are less likely to be trash
+    {"category": "Trash", "if_greater": "Compostable", "weight": -20, "floor": 0},
+]
+
+COMPARATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class ScoringRules:
+    """IMAGE_RULES compiled once, evaluated per image (plain Python) or over feature arrays (NumPy).
+
+    Every condition is a tunable parameter named "rule:feature>" (e.g. "trash_dark:black_ratio>");
+    the array path takes {param: threshold array} overrides so many threshold sets can be scored at once.
+    """
+
+    def __init__(self, rules, adjustments=()):
+        self.rules = []
+        self.params = {}
+        names = set()
+        for rule in rules:
+            unknown = set(rule) - {"name", "category", "weight", "all", "any", "else_of"}
+            if unknown or rule["category"] not in CATEGORIES or ("all" in rule) == ("any" in rule):
+                raise ValueError(f"bad scoring rule: {rule}")
+            if rule.get("else_of") and rule["else_of"] not in names:
+                raise ValueError(f"rule {rule['name']} is else_of an unknown or later rule")
+            conditions = []
+            for feature, comparator, threshold in rule.get("all") or rule.get("any"):
+                parts = tuple(feature.split("+"))
+                if not set(parts) <= set(ImageFeatures._fields) or comparator not in COMPARATORS:
+                    raise ValueError(f"bad condition in rule {rule['name']}: {feature} {comparator}")
+                param = f"{rule['name']}:{feature}{comparator}"
+                self.params[param] = threshold
+                conditions.append((param, parts, COMPARATORS[comparator], threshold))
+            self.rules.append((rule["name"], rule["category"], rule["weight"], "all" in rule,
+                               rule.get("else_of"), conditions))
+            names.add(rule["name"])
+        self.adjustments = [(a["category"], a["if_greater"], a["weight"], a["floor"]) for a in adjustments]
+        self.source = {"rules": [dict(rule) for rule in rules], "adjustments": [dict(a) for a in adjustments]}
+        self.fingerprint = hashlib.blake2b(json.dumps(self.source, sort_keys=True).encode(), digest_size=6).hexdigest()
+
+        # most each category can get from the image rules alone, used to bound the cascade.
+        # an else_of chain fires at most one rule, so it only counts its largest weight
+        chains, best = {}, {}
+        for name, category, weight, _, else_of, _ in self.rules:
+            root = chains[name] = chains[else_of] if else_of else name
+            best[category, root] = max(best.get((category, root), 0), weight)
+        self.max_scores = {category: sum(w for (c, _), w in best.items() if c == category) for category in CATEGORIES}
+
+    def image_scores(self, f):
+        scores = dict.fromkeys(CATEGORIES, 0)
+        fired = {}
+        for name, category, weight, require_all, else_of, conditions in self.rules:
+            hit = False
+            if not (else_of and fired[else_of]):
+                tests = (compare(_feature_value(f, parts), threshold) for _, parts, compare, threshold in conditions)
+                hit = all(tests) if require_all else any(tests)
+            fired[name] = hit
+            if hit:
+                scores[category] += weight
+        for category, if_greater, weight, floor in self.adjustments:
+            if scores[if_greater] > scores[category]:
+                scores[category] = max(floor, scores[category] + weight)
+        return scores
+
+    def image_scores_batch(self, f, thresholds=None):
+        """{category: int array} for ImageFeatures of arrays. thresholds maps params to arrays of shape
+        (K, 1), which broadcasts every result to (K, N): one row of scores per threshold set."""
+        thresholds = thresholds or {}
+        zeros = np.zeros(np.shape(f.green_ratio), np.int64)
+        scores = dict.fromkeys(CATEGORIES, zeros)
+        fired = {}
+        values = {}
+        for name, category, weight, require_all, else_of, conditions in self.rules:
+            hit = None
+            for param, parts, compare, threshold in conditions:
+                if parts not in values:
+                    values[parts] = _feature_value(f, parts)
+                test = compare(values[parts], thresholds.get(param, threshold))
+                hit = test if hit is None else (hit & test if require_all else hit | test)
+            if else_of:
+                hit = hit & ~fired[else_of]
+            fired[name] = hit
+            scores[category] = scores[category] + weight * hit
+        for category, if_greater, weight, floor in self.adjustments:
+            scores[category] = np.where(scores[if_greater] > scores[category],
+                                        np.maximum(floor, scores[category] + weight), scores[category])
+        return scores
+
+    def with_thresholds(self, thresholds):
+        """A copy with some condition thresholds replaced, {param: value}"""
+        unknown = set(thresholds) - set(self.params)
+        if unknown:
+            raise ValueError(f"unknown rule parameters: {', '.join(sorted(unknown))}")
+        rules = []
+        for rule in self.source["rules"]:
+            key = "all" if "all" in rule else "any"
+            rule = dict(rule)
+            rule[key] = [(feature, comparator, thresholds.get(f"{rule['name']}:{feature}{comparator}", threshold))
+                         for feature, comparator, threshold in rule[key]]
+            rules.append(rule)
+        return ScoringRules(rules, self.source["adjustments"])
+
+    def to_file(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.source, f, indent=2)
+
+    @classmethod
+    def from_file(cls, path):
+        # JSON shaped like {"rules": IMAGE_RULES, "adjustments": SCORE_ADJUSTMENTS}
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        rules = [dict(rule, **{key: [tuple(c) for c in rule[key]] for key in ("all", "any") if key in rule})
+                 for rule in data["rules"]]
+        return cls(rules, data.get("adjustments", SCORE_ADJUSTMENTS))
+
+
+def _feature_value(f, parts):
+    # "a+b+c" adds left to right, the same float operations as writing it out by hand
+    value = getattr(f, parts[0])
+    for part in parts[1:]:
+        value = value + getattr(f, part)
+    return value
+
+
+scoring_rules = ScoringRules(IMAGE_RULES, SCORE_ADJUSTMENTS)
+
+def load_rules(path):
+    """Replace the built-in image rules with the ones in a JSON file (e.g. written by the threshold search)"""
+    global scoring_rules
+    scoring_rules = ScoringRules.from_file(path)
+    return scoring_rules
+
+def image_scores(f):
+    return scoring_rules.image_scores(f)
+
+
+def keyword_scores(description):
+    # --- Strong keyword detection ---
+    hits = keyword_hits(description)
+    return {category: KEYWORD_SCORE if hits[category] else 0 for category in CATEGORIES}
+
+
+def normalize_scores(scores):
+    # Base safeguard
+    recyclable_score = scores["Recyclable"] + BASE_SCORE
+    reusable_score = scores["Reusable"] + BASE_SCORE
+    compostable_score = scores["Compostable"] + BASE_SCORE
+    trash_score = scores["Trash"] + BASE_SCORE
+
+    # --- Normalize ---
+    total = recyclable_score + reusable_score + compostable_score + trash_score
+    recyclable_percent = int((recyclable_score / total) * 100)
+    reusable_percent = int((reusable_score / total) * 100)
+    compostable_percent = int((compostable_score / total) * 100)
+    trash_percent = 100 - recyclable_percent - reusable_percent - compostable_percent
+
+    probabilities = {
+        "Recyclable": recyclable_percent,
+        "Reusable": reusable_percent,
+        "Compostable": compostable_percent,
+        "Trash": trash_percent
+    }
+
+    most_likely = max(probabilities, key=probabilities.get)
+
+    return probabilities, most_likely
+
+
+def score_features(f, description="", timer=None):
+    images = image_scores(f)
+    if timer:
+        timer.lap("image_rules")
+    keywords = keyword_scores(description)
+    if timer:
+        timer.lap("keywords")
+    result = normalize_scores({category: images[category] + keywords[category] for category in CATEGORIES})
+    if timer:
+        timer.lap("normalize")
+    return result
+
+
+def score_features_batch(f, descriptions):
+    """The score_features rules as array arithmetic, returns (N, 4) percentages in CATEGORIES order and the argmax"""
+    return score_features_matrix(f, keyword_hit_matrix(descriptions))
+
+def keyword_hit_matrix(descriptions):
+    # (N, 4) bool, whether each description mentions a keyword of each category in CATEGORIES order
+    hits = [[h[category] for category in CATEGORIES] for h in map(keyword_hits, descriptions)]
+    return np.array(hits, dtype=bool).reshape(len(descriptions), len(CATEGORIES))
+
+def score_features_matrix(f, hits, thresholds=None):
+    """score_features_batch with the keyword hits already worked out, e.g. stored ones when rescoring history.
+
+    With thresholds (see ScoringRules.image_scores_batch) the results gain a leading axis, one per threshold set.
+    """
+    images = scoring_rules.image_scores_batch(f, thresholds)
+    scores = np.stack(np.broadcast_arrays(*(images[category] for category in CATEGORIES)), axis=-1)
+
+    # --- Strong keyword detection ---
+    scores = scores + KEYWORD_SCORE * hits + BASE_SCORE
+
+    # --- Normalize --- (same float operations as the scalar path so the results are identical)
+    total = scores.sum(axis=-1, keepdims=True)
+    percents = ((scores / total) * 100).astype(np.int64)
+    percents[..., 3] = 100 - percents[..., :3].sum(axis=-1)
+
+    return percents, np.argmax(percents, axis=-1)
+
+
+# ---- WORKER PROCESSES ----
+
+def worker_initargs():
+    """initargs for init_worker: the scoring rules and keyword vocabulary in use in this process"""
+    return scoring_rules.source, keyword_matcher.source
+
+def init_worker(rules_source, keyword_source):
+    """ProcessPoolExecutor initializer shared by every pool (classify-dir, tune, the server).
+
+    Pool processes may be spawned rather than forked, so --rules and --keywords only reach them
+    through here. Task functions must be top-level so they can be pickled. Ctrl+C reaches the whole
+    process group, workers ignore it and leave shutting the pool down to the parent.
+    """
+    global scoring_rules, keyword_matcher
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    scoring_rules = ScoringRules(rules_source["rules"], rules_source["adjustments"])
+    keyword_matcher = KeywordMatcher(keyword_source)
+
+
+# ---- PROFILING ----
+
+# a profiling.Profiler while per-stage timing is switched on, None (the default) otherwise
+profiler = None
+
+def enable_profiling():
+    """Start recording per-stage timings for classify_with_opencv in this process and return the profiler"""
+    global profiler
+    if profiler is None:
+        import profiling
+        profiler = profiling.Profiler()
+    return profiler
+
+def disable_profiling():
+    global profiler
+    profiler = None
+
+
+# ---- IMAGE INGEST ----
+
+CLASSIFY_SIZE = 300
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff")
+
+def iter_files(root_dir, extensions=IMAGE_EXTENSIONS):
+    """Every file under root_dir ending in one of extensions (lowercase), in a stable order"""
+    # sorted walk so reruns process files the same way
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions):
+                yield os.path.join(dirpath, name)
+
+# cv2 can decode JPEGs straight at 1/2, 1/4 or 1/8 scale using DCT scaling
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+def pick_read_flag(source, target=CLASSIFY_SIZE):
+    # only the file header is parsed here, no pixels are decoded. source is a path or a file object
+    from PIL import Image
+
+    try:
+        with Image.open(source) as header:
+            width, height = header.size
+            fmt = header.format
+    except Exception:
+        return cv2.IMREAD_COLOR
+
+    # other formats gain nothing from a reduced read, cv2 would decode fully and shrink afterwards
+    if fmt != "JPEG":
+        return cv2.IMREAD_COLOR
+
+    for factor, flag in REDUCED_READ_FLAGS:
+        # never go below the classifier resolution on either side
+        if width // factor >= target and height // factor >= target:
+            return flag
+    return cv2.IMREAD_COLOR
+
+def load_image(image_path, target=CLASSIFY_SIZE, timer=None):
+    """Decode only as much of the image as the classifier needs and return it at target x target"""
+    flag = pick_read_flag(image_path, target)
+    if timer:
+        timer.lap("header")
+    img = cv2.imread(image_path, flag)
+    if timer:
+        timer.lap("imread")
+    if img is None:
+        return None
+    if timer:
+        timer.note_image(img.shape)
+    img = cv2.resize(img, (target, target))
+    if timer:
+        timer.lap("resize")
+    return img
+
+def decode_image_bytes(data, target=CLASSIFY_SIZE, timer=None):
+    """load_image for an encoded image already in memory (an upload, a network read)"""
+    flag = pick_read_flag(io.BytesIO(data), target)
+    if timer:
+        timer.lap("header")
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if timer:
+        timer.lap("imread")
+    if img is None:
+        return None
+    if timer:
+        timer.note_image(img.shape)
+    img = cv2.resize(img, (target, target))
+    if timer:
+        timer.lap("resize")
+    return img
+
+
+def _path_features(image_path):
+    def features_of(timer):
+        img = load_image(image_path, timer=timer)
+        return None if img is None else extract_features(img, timer)
+    return features_of
+
+def classify_with_opencv(image_path, description=""):
+    return _classify_features(_path_features(image_path), description)
+
+# the answer for an image that can't be read or makes OpenCV fail: no evidence for any category
+FALLBACK_RESULT = ({"Recyclable": 25, "Reusable": 25, "Compostable": 25, "Trash": 25}, "Trash")
+
+def fallback_result():
+    # a fresh probabilities dict each time, callers are free to change theirs
+    probabilities, most_likely = FALLBACK_RESULT
+    return dict(probabilities), most_likely
+
+def _classify_features(features_of, description, fallback=True):
+    # shared by classify_with_opencv and ImageHandle.classify: features_of(timer) returns the
+    # image's features, or None when it can't be decoded. With fallback=False an image that
+    # can't be classified gives None instead of FALLBACK_RESULT
+    timer = profiler.start() if profiler is not None else None
+    try:
+        features = features_of(timer)
+        if features is None:
+            if timer:
+                timer.fallback("unreadable")
+            return fallback_result() if fallback else None
+
+        return score_features(features, description, timer)
+
+    except Exception as e:
+        print("OpenCV Error:", e)
+        if timer:
+            timer.fallback("error", e)
+        return fallback_result() if fallback else None
+
+    finally:
+        if timer:
+            timer.finish()
+
+
+def classify_batch(paths, descriptions=None, features_out=None):
+    """Classify many images at once, returns the same (probabilities, most_likely) pairs as classify_with_opencv"""
+    if descriptions is None or isinstance(descriptions, str):
+        descriptions = [descriptions or ""] * len(paths)
+
+    images = []
+    for path in paths:
+        try:
+            images.append(load_image(path))
+        except Exception as e:
+            print("OpenCV Error:", e)
+            images.append(None)
+    return classify_images(images, descriptions, features_out)
+
+def classify_images(images, descriptions, features_out=None):
+    """classify_batch for images that are already decoded and resized, None entries get the fallback result.
+
+    Pass a list as features_out to also get each image's ImageFeatures (None for unreadable ones),
+    e.g. to keep them in the feature store.
+    """
+    results = [fallback_result() for _ in images]
+    if features_out is not None:
+        features_out[:] = [None] * len(images)
+    index = [i for i, img in enumerate(images) if img is not None]
+    if not index:
+        return results
+    images = [images[i] for i in index]
+
+    features = extract_features_batch(np.stack(images))
+    percents, best = score_features_batch(features, [descriptions[i] for i in index])
+    for row, i in enumerate(index):
+        probabilities = {category: int(p) for category, p in zip(CATEGORIES, percents[row])}
+        results[i] = (probabilities, CATEGORIES[best[row]])
+        if features_out is not None:
+            features_out[i] = ImageFeatures(*(float(column[row]) for column in features))
+    return results
+
+
+# ---- IMAGE HANDLE ----
+
+class ImageHandle:
+    """An image file read from disk once, shared by the GUI preview and the classifier.
+
+    The preview and the 300x300 classifier array are both decoded from the same in-memory bytes,
+    and the array and its features are kept so classifying again with another description only
+    re-runs the scoring.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # taken before reading, so a write that lands mid-read still shows up as a change
+        st = os.stat(path)
+        self.signature = (st.st_size, st.st_mtime_ns)
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self._hash = None
+        self._array = None
+        self._features = None
+
+    def unchanged(self):
+        """Whether the file on disk still has the size and mtime it had when it was read"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return (st.st_size, st.st_mtime_ns) == self.signature
+
+    def content_hash(self):
+        if self._hash is None:
+            self._hash = hash_bytes(self.data)
+        return self._hash
+
+    def preview(self, size):
+        """A PIL image at most size x 2 on each side, for a CTkImage of that size"""
+        from PIL import Image
+
+        img = Image.open(io.BytesIO(self.data))
+        # draft lets PIL decode JPEGs straight at a reduced scale, thumbnail then shrinks the rest
+        # with reduce() and keeps the aspect ratio
+        img.draft("RGB", (size[0] * 2, size[1] * 2))
+        img.thumbnail((size[0] * 2, size[1] * 2))
+        img.load()
+        return img
+
+    def array(self, timer=None):
+        """The image as a CLASSIFY_SIZE x CLASSIFY_SIZE BGR array, decoded on first use; None if unreadable"""
+        if self._array is None:
+            self._array = decode_image_bytes(self.data, CLASSIFY_SIZE, timer)
+        return self._array
+
+    def features(self, timer=None):
+        if self._features is None:
+            img = self.array(timer)
+            if img is None:
+                return None
+            self._features = extract_features(img, timer)
+        return self._features
+
+    @property
+    def decoded_features(self):
+        # features if this handle has been classified already, without decoding anything
+        return self._features
+
+    def classify(self, description=""):
+        """Same result as classify_with_opencv(self.path, description), without touching the disk again"""
+        return _classify_features(self.features, description)
+
+
+# ---- CASCADE CLASSIFIER ----
+
+CASCADE_STAGES = ["keywords", "low_res", "full"]
+CASCADE_LOW_RES = 100
+
+# score-point lead the top category needs to stop at each stage. With a keyword margin of 0
+# the keyword stage only exits when no image could change the winner.
+CASCADE_KEYWORD_MARGIN = 0
+CASCADE_LOW_RES_MARGIN = 40
+
+cascade_stats = {stage: 0 for stage in CASCADE_STAGES}
+
+def _lead(scores):
+    # (winner, how far it is ahead of the runner-up)
+    ranked = sorted(CATEGORIES, key=lambda category: scores[category], reverse=True)
+    return ranked[0], scores[ranked[0]] - scores[ranked[1]]
+
+def _keyword_lead(keywords):
+    # worst case for the keyword leader is an image that scores 0 for it and the most for everyone else
+    leader = max(CATEGORIES, key=lambda category: keywords[category])
+    best_other = max(keywords[category] + scoring_rules.max_scores[category] for category in CATEGORIES if category != leader)
+    return leader, keywords[leader] - best_other
+
+def classify_cascade(image_path, description="", keyword_margin=CASCADE_KEYWORD_MARGIN,
+                     low_res_margin=CASCADE_LOW_RES_MARGIN, low_res=CASCADE_LOW_RES):
+    """Cheap stages first: keywords only, then a low_res feature pass, then the full 300x300 pass.
+
+    Returns (probabilities, most_likely, stage). Early exits report probabilities from the stage that
+    decided, so they can differ from classify_with_opencv even when the category agrees.
+    """
+    try:
+        keywords = keyword_scores(description)
+        leader, lead = _keyword_lead(keywords)
+        if lead >= keyword_margin:
+            cascade_stats["keywords"] += 1
+            return normalize_scores(keywords) + ("keywords",)
+
+        img = load_image(image_path, low_res)
+        if img is None:
+            cascade_stats["full"] += 1
+            return (*fallback_result(), "full")
+
+        images = image_scores(extract_features(img))
+        scores = {category: images[category] + keywords[category] for category in CATEGORIES}
+        leader, lead = _lead(scores)
+        if lead >= low_res_margin:
+            cascade_stats["low_res"] += 1
+            return normalize_scores(scores) + ("low_res",)
+
+        cascade_stats["full"] += 1
+        return classify_with_opencv(image_path, description) + ("full",)
+
+    except Exception as e:
+        print("OpenCV Error:", e)
+        cascade_stats["full"] += 1
+        return (*fallback_result(), "full")
+
+def cascade_report(stats=None):
+    stats = cascade_stats if stats is None else stats
+    total = sum(stats.values())
+    return {stage: {"count": stats[stage], "rate": stats[stage] / total if total else 0.0}
+            for stage in CASCADE_STAGES}
+
+
+# ---- CLASSIFICATION CACHE ----
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_bytes(data):
+    # same digest as hash_file, for content already in memory
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+def cache_key(content_hash, description=""):
+    # scoring lowercases the description and keywords never start or end with spaces,
+    # so this normalization can't change the result. The vocabulary and rule fingerprints keep
+    # results scored with a different keyword list or different thresholds from being served.
+    return f"{content_hash}:{keyword_matcher.fingerprint}{scoring_rules.fingerprint}:{description.strip().lower()}"
+
+
+class ClassificationCache:
+    """Two tier cache of classify_with_opencv results: an in-memory LRU in front of a sqlite table"""
+
+    def __init__(self, db_conn, memory_size=256, disk_size=50000):
+        self.conn = db_conn
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()
+        self.file_hashes = OrderedDict()  # (path, size, mtime) -> content hash, skips re-hashing unchanged files
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.disk_count = self.conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+
+    def content_hash(self, path):
+        st = os.stat(path)
+        file_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if file_key in self.file_hashes:
+            self.file_hashes.move_to_end(file_key)
+            return self.file_hashes[file_key]
+
+        digest = hash_file(path)
+        self.file_hashes[file_key] = digest
+        if len(self.file_hashes) > self.memory_size:
+            self.file_hashes.popitem(last=False)
+        return digest
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self.memory[key]
+
+        row = self.conn.execute("SELECT probabilities, category FROM classification_cache WHERE key=?", (key,)).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.conn.execute("UPDATE classification_cache SET last_used=? WHERE key=?", (time.time(), key))
+        self.conn.commit()
+        value = (json.loads(row[0]), row[1])
+        self._remember(key, value)
+        self.stats["disk_hits"] += 1
+        return value
+
+    def put(self, key, probabilities, category):
+        self._remember(key, (probabilities, category))
+        cur = self.conn.execute(
+            "INSERT OR REPLACE INTO classification_cache (key, probabilities, category, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(probabilities), category, time.time()))
+        self.disk_count += cur.rowcount
+        if self.disk_count > self.disk_size:
+            self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        # drop the least recently used rows, plus a 10% margin so we don't evict on every insert
+        excess = self.disk_count - int(self.disk_size * 0.9)
+        cur = self.conn.execute("""
+            DELETE FROM classification_cache WHERE key IN (
+                SELECT key FROM classification_cache ORDER BY last_used LIMIT ?
+            )""", (excess,))
+        self.stats["evictions"] += cur.rowcount
+        self.disk_count = self.conn.execute("SELECT COUNT(*) FROM classification_cache").fetchone()[0]
+
+    def snapshot(self):
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return dict(self.stats, lookups=lookups, hit_rate=hits / lookups if lookups else 0.0,
+                    memory_entries=len(self.memory), disk_entries=self.disk_count)
+
+    def clear(self):
+        self.memory.clear()
+        self.file_hashes.clear()
+        self.conn.execute("DELETE FROM classification_cache")
+        self.conn.commit()
+        self.disk_count = 0
+
+
+def classify_cached(image, description, cache):
+    """classify_with_opencv, but repeated classifications of the same image + description come from the cache.
+
+    image is a path or an ImageHandle that has already read the file.
+    """
+    handle = image if isinstance(image, ImageHandle) else None
+    try:
+        key = cache_key(handle.content_hash() if handle else cache.content_hash(image), description)
+    except OSError:
+        return classify_with_opencv(image, description)
+
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    result = _classify_features(handle.features if handle else _path_features(image), description, fallback=False)
+    if result is None:
+        # not remembered: the file may be readable next time, e.g. once it has finished copying
+        return fallback_result()
+    probabilities, most_likely = result
+    cache.put(key, probabilities, most_likely)
+    return probabilities, most_likely
+
+
+def history_item_name(image_path, description=""):
+    item_name = os.path.basename(image_path)
+    if description:
+        item_name = f"{item_name} ({description})"
+    return item_name
@@ -0,0 +1,468 @@
+"""Headless Sortify tools: python cli.py classify-dir | bench-decode | verify-batch"""
+import os
+import sys
+import time
+import argparse
+import itertools
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import classifier
+import persistence
+from feature_store import FeatureStore, default_path as feature_store_path
+from classifier import (CASCADE_LOW_RES_MARGIN, CLASSIFY_SIZE, cascade_report, cascade_stats, classify_batch,
+                        classify_cascade, classify_with_opencv, enable_profiling, history_item_name, iter_files,
+                        load_keywords, load_rules, pick_read_flag)
+
+# ---- BATCH CLASSIFICATION ----
+
+def _classify_chunk(job):
+    # one chunk of paths, in a pool process
+    paths, description, cascade, low_res_margin = job
+    if cascade:
+        # early exits never compute full-resolution features, so nothing goes to the feature store
+        results = [classify_cascade(path, description, low_res_margin=low_res_margin) for path in paths]
+        return [(path, (probabilities, most_likely), stage, None)
+                for path, (probabilities, most_likely, stage) in zip(paths, results)]
+    features = []
+    results = classify_batch(paths, description, features)
+    return [(path, result, "full", f) for path, result, f in zip(paths, results, features)]
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def classify_directory(root_dir, username, description="", workers=None, batch_size=500, cascade=False,
+                       low_res_margin=CASCADE_LOW_RES_MARGIN):
+    """Classify every image under root_dir across a process pool and log the results to history"""
+    workers = workers or os.cpu_count() or 1
+    jobs = ((paths, description, cascade, low_res_margin) for paths in _chunked(iter_files(root_dir), 32))
+    counts = {"Recyclable": 0, "Reusable": 0, "Compostable": 0, "Trash": 0}
+
+    # the writer group-commits history rows, batch_size rows per transaction
+    store = FeatureStore(feature_store_path(persistence.DEFAULT_DB_PATH))
+    with persistence.WriteBehindWriter(persistence.DEFAULT_DB_PATH, max_batch=batch_size, feature_store=store) as writer:
+        with ProcessPoolExecutor(max_workers=workers, initializer=classifier.init_worker,
+                                 initargs=classifier.worker_initargs()) as pool:
+            try:
+                for path, (probabilities, most_likely), stage, features in itertools.chain.from_iterable(pool.map(_classify_chunk, jobs)):
+                    writer.insert_history(username, most_likely, history_item_name(path, description),
+                                          features=features, description=description)
+                    counts[most_likely] += 1
+                    if cascade:
+                        # stage counters live in the worker processes, tally them here instead
+                        cascade_stats[stage] += 1
+            except KeyboardInterrupt:
+                # every chunk is already submitted, drop the ones not started rather than wait for them
+                pool.shutdown(cancel_futures=True)
+                raise
+
+    return counts
+
+
+def verify_batch_matches_scalar(paths, descriptions=("",)):
+    mismatches = []
+    for description in descriptions:
+        for path, batched in zip(paths, classify_batch(paths, description)):
+            scalar = classify_with_opencv(path, description)
+            if scalar != batched:
+                mismatches.append((path, description, scalar, batched))
+    return mismatches
+
+
+def bench_decode_paths(paths, repeat=3):
+    # decode each image the old way (full decode then resize) and the way load_image does
+    results = {}
+    for mode in ("full", "reduced"):
+        seconds = 0.0
+        peak_bytes = 0
+        for path in paths:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                flag = pick_read_flag(path) if mode == "reduced" else cv2.IMREAD_COLOR
+                raw = cv2.imread(path, flag)
+                if raw is None:
+                    break
+                cv2.resize(raw, (CLASSIFY_SIZE, CLASSIFY_SIZE))
+                seconds += time.perf_counter() - start
+                # size of the decoded pixel buffer, which is what dominates peak RSS
+                peak_bytes = max(peak_bytes, raw.nbytes)
+        results[mode] = (seconds, peak_bytes)
+
+    runs = max(1, len(paths) * repeat)
+    for mode, (seconds, peak_bytes) in results.items():
+        print(f"{mode:>8}: {seconds / runs * 1000:.2f} ms/image, largest decoded buffer {peak_bytes / 2**20:.1f} MiB")
+    full_time, full_bytes = results["full"]
+    reduced_time, reduced_bytes = results["reduced"]
+    if reduced_time > 0 and reduced_bytes > 0:
+        print(f"speedup: {full_time / reduced_time:.1f}x, memory: {full_bytes / reduced_bytes:.1f}x smaller")
+    return results
+
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="sortify", description="Sortify headless tools")
+    parser.add_argument("--keywords", help="JSON file of category keywords to use instead of the built-in lists")
+    parser.add_argument("--rules", help="JSON file of image scoring rules, e.g. written by tune --output")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    classify_dir = sub.add_parser("classify-dir", help="classify every image in a folder tree")
+    classify_dir.add_argument("path")
+    classify_dir.add_argument("--user", default="batch", help="username recorded in history")
+    classify_dir.add_argument("--description", default="", help="description applied to every image")
+    classify_dir.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    classify_dir.add_argument("--batch-size", type=int, default=500, help="history rows per commit")
+    classify_dir.add_argument("--cascade", action="store_true",
+                              help="stop at the keyword or low-resolution stage when the result is already decisive")
+    classify_dir.add_argument("--low-res-margin", type=int, default=CASCADE_LOW_RES_MARGIN,
+                              help="score lead needed to stop after the low-resolution pass")
+
+    bench_decode = sub.add_parser("bench-decode", help="compare full and reduced-resolution decoding")
+    bench_decode.add_argument("path", help="image file or folder")
+    bench_decode.add_argument("--repeat", type=int, default=3, help="decodes per image for each mode")
+
+    verify_batch = sub.add_parser("verify-batch", help="check classify_batch against classify_with_opencv")
+    verify_batch.add_argument("path", help="folder of images")
+    verify_batch.add_argument("--description", action="append", default=None,
+                              help="description to test with, can be given several times")
+
+    bench = sub.add_parser("bench", help="time decode, features, scoring and database writes on a synthetic corpus")
+    bench.add_argument("--corpus", default=None, help="folder for the generated images (default: a temporary folder)")
+    bench.add_argument("--count", type=int, default=48, help="images in the corpus")
+    bench.add_argument("--seed", type=int, default=0, help="corpus seed, keep it fixed when comparing versions")
+    bench.add_argument("--repeat", type=int, default=3, help="timed passes over the corpus")
+    bench.add_argument("--db-rows", type=int, default=2000, help="rows written per database benchmark")
+    bench.add_argument("--label", default=None, help="name stored with the results, e.g. a version or commit")
+    bench.add_argument("--output", help="write the results to this JSON file")
+    bench.add_argument("--compare", help="earlier results JSON, exits with status 1 if a stage's p50 regressed")
+    bench.add_argument("--threshold", type=float, default=0.20, help="p50 slowdown that counts as a regression")
+
+    profile = sub.add_parser("profile", help="classify a folder with per-stage timing and print where the time goes")
+    profile.add_argument("path", help="image file or folder")
+    profile.add_argument("--description", default="", help="description applied to every image")
+    profile.add_argument("--repeat", type=int, default=1, help="passes over the images")
+    profile.add_argument("--output", help="also write the histograms to this JSON file")
+
+    watch = sub.add_parser("watch", help="keep classifying images as they are dropped into a folder")
+    watch.add_argument("path", help="folder to watch")
+    watch.add_argument("--user", default="scanner", help="username recorded in history")
+    watch.add_argument("--description", default="", help="description applied to every image")
+    watch.add_argument("--decode-workers", type=int, default=2, help="threads reading and decoding files")
+    watch.add_argument("--classify-workers", type=int, default=2, help="threads computing features and scores")
+    watch.add_argument("--queue-size", type=int, default=64, help="items each stage queue holds before blocking")
+    watch.add_argument("--batch-size", type=int, default=100, help="history rows per commit")
+    watch.add_argument("--poll", type=float, default=2.0, help="seconds between folder scans")
+    watch.add_argument("--settle", type=float, default=2.0, help="ignore files modified more recently than this")
+    watch.add_argument("--report-interval", type=float, default=10.0, help="seconds between queue depth reports, 0 for none")
+    watch.add_argument("--once", action="store_true", help="ingest what is in the folder now and exit")
+
+    rescore = sub.add_parser("rescore", help="re-run the scoring rules over stored features, no images decoded")
+    rescore.add_argument("--db", default=persistence.DEFAULT_DB_PATH, help="database whose history is compared")
+    rescore.add_argument("--store", default=None, help="feature store file (default: next to the database)")
+    rescore.add_argument("--apply", action="store_true", help="write the new categories back to history")
+
+    tune = sub.add_parser("tune", help="search rule thresholds that agree best with user feedback")
+    tune.add_argument("--db", default=persistence.DEFAULT_DB_PATH, help="database holding the feedback")
+    tune.add_argument("--store", default=None, help="feature store file (default: next to the database)")
+    tune.add_argument("--samples", type=int, default=20000, help="random threshold sets to try")
+    tune.add_argument("--spread", type=float, default=0.5, help="how far a random threshold may move, as a fraction")
+    tune.add_argument("--param", action="append", default=None,
+                      help="only vary this parameter in the random search, can be given several times")
+    tune.add_argument("--grid", action="append", default=None, metavar="PARAM=LO:HI:STEPS",
+                      help="try every combination of evenly spaced values instead, can be given several times")
+    tune.add_argument("--workers", type=int, default=None, help="worker processes (default: cpu count)")
+    tune.add_argument("--top", type=int, default=5, help="threshold sets to list")
+    tune.add_argument("--seed", type=int, default=0, help="random search seed")
+    tune.add_argument("--output", help="write the rules with the best thresholds to this JSON file")
+
+    classify_video = sub.add_parser("classify-video", help="classify the items passing through conveyor-belt videos")
+    classify_video.add_argument("paths", nargs="+", help="video files or folders of them")
+    classify_video.add_argument("--user", default="video", help="username recorded in history")
+    classify_video.add_argument("--description", default="", help="description applied to every item")
+    classify_video.add_argument("--sample-fps", type=float, default=5.0, help="frames classified per second of video")
+    classify_video.add_argument("--window", type=int, default=5, help="sampled frames averaged when smoothing")
+    classify_video.add_argument("--min-seconds", type=float, default=0.8,
+                                help="shortest item, and how long a category change must last to split items")
+    classify_video.add_argument("--presence", type=float, default=0.05,
+                                help="share of the frame that must differ from the empty belt, 0 treats the video as one stream")
+    classify_video.add_argument("--dry-run", action="store_true", help="print the items without recording them")
+
+    classify_regions = sub.add_parser("classify-regions", help="classify each part of an image, e.g. a mixed bin")
+    classify_regions.add_argument("path", help="image file")
+    classify_regions.add_argument("--grid", default="4x4", help="ROWSxCOLS grid of regions (default: 4x4)")
+    classify_regions.add_argument("--window", type=int, default=None,
+                                  help="scan square windows of this many pixels instead of a grid, at the grid's working size")
+    classify_regions.add_argument("--stride", type=int, default=None, help="window step in pixels (default: half a window)")
+    classify_regions.add_argument("--description", default="", help="description applied to every region")
+    classify_regions.add_argument("--output", help="write a copy of the image with the regions drawn in")
+
+    export = sub.add_parser("export", help="stream a table to CSV or JSON lines")
+    export.add_argument("table", choices=["history", "feedback", "eco_points"])
+    export.add_argument("--db", default=persistence.DEFAULT_DB_PATH, help="database to read")
+    export.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    export.add_argument("--output", help="file to write (default: standard output)")
+    export.add_argument("--since", help="first day to include, YYYY-MM-DD (history and feedback only)")
+    export.add_argument("--until", help="day to stop before, YYYY-MM-DD (history and feedback only)")
+    export.add_argument("--chunk-size", type=int, default=5000, help="rows fetched from SQLite at a time")
+
+    report = sub.add_parser("report", help="aggregate history or feedback inside SQLite")
+    report.add_argument("report", choices=["categories", "daily", "feedback"],
+                        help="categories per user and day, categories per day, or incorrect feedback rate per category")
+    report.add_argument("--db", default=persistence.DEFAULT_DB_PATH, help="database to read")
+    report.add_argument("--format", choices=["table", "csv", "jsonl"], default="table")
+    report.add_argument("--output", help="file to write (default: standard output)")
+    report.add_argument("--since", help="first day to include, YYYY-MM-DD")
+    report.add_argument("--until", help="day to stop before, YYYY-MM-DD")
+
+    args = parser.parse_args(argv)
+    for path, load in ((args.keywords, load_keywords), (args.rules, load_rules)):
+        if path:
+            try:
+                load(path)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                parser.error(f"cannot load {path}: {e}")
+
+    if args.command == "classify-dir":
+        if not os.path.isdir(args.path):
+            parser.error(f"not a directory: {args.path}")
+        start = time.perf_counter()
+        counts = classify_directory(args.path, args.user, args.description, args.workers, args.batch_size,
+                                    args.cascade, args.low_res_margin)
+        elapsed = time.perf_counter() - start
+        total = sum(counts.values())
+        for category, count in counts.items():
+            print(f"{category}: {count}")
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"Classified {total} images in {elapsed:.1f}s ({rate:.1f} images/s)")
+        if args.cascade:
+            for stage, report in cascade_report().items():
+                print(f"  exited at {stage}: {report['count']} ({report['rate']:.1%})")
+
+    elif args.command == "verify-batch":
+        paths = list(iter_files(args.path))
+        mismatches = verify_batch_matches_scalar(paths, args.description or [""])
+        for path, description, scalar, batched in mismatches:
+            print(f"MISMATCH {path} ({description!r}): scalar={scalar} batch={batched}")
+        print(f"Checked {len(paths)} images, {len(mismatches)} mismatches")
+        if mismatches:
+            sys.exit(1)
+
+    elif args.command == "bench":
+        import bench as bench_suite
+        if args.corpus:
+            results = bench_suite.run_suite(args.corpus, args.count, args.seed, args.repeat, args.db_rows, args.label)
+        else:
+            with tempfile.TemporaryDirectory() as corpus:
+                results = bench_suite.run_suite(corpus, args.count, args.seed, args.repeat, args.db_rows, args.label)
+        bench_suite.print_results(results)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if bench_suite.compare_results(baseline, results, args.threshold):
+                sys.exit(1)
+
+    elif args.command == "profile":
+        import profiling
+        paths = list(iter_files(args.path)) if os.path.isdir(args.path) else [args.path]
+        profiler = enable_profiling()
+        for _ in range(args.repeat):
+            for path in paths:
+                classify_with_opencv(path, args.description)
+        print(profiling.format_report(profiler.snapshot()))
+        if args.output:
+            profiler.dump(args.output)
+
+    elif args.command == "watch":
+        import ingest
+        if not os.path.isdir(args.path):
+            parser.error(f"not a directory: {args.path}")
+        pipeline = ingest.IngestPipeline(args.path, args.user, args.description,
+                                         decode_workers=args.decode_workers, classify_workers=args.classify_workers,
+                                         queue_size=args.queue_size, batch_size=args.batch_size,
+                                         poll_interval=args.poll, settle=args.settle)
+        print(f"Watching {args.path} (Ctrl+C to stop)" if not args.once else f"Ingesting {args.path}")
+        pipeline.run(args.once, args.report_interval)
+        pipeline.report()
+
+    elif args.command == "rescore":
+        import feature_store
+        store = FeatureStore(args.store or feature_store_path(args.db))
+        db = persistence.init_db(args.db)
+        start = time.perf_counter()
+        report = feature_store.rescore(db, store, apply=args.apply)
+        elapsed = time.perf_counter() - start
+        db.close()
+        rate = report["rows"] / elapsed if elapsed > 0 else 0.0
+        print(f"Rescored {report['rows']} rows in {elapsed:.2f}s ({rate:,.0f} rows/s), "
+              f"{report['matched']} matched to history")
+        for (old, new), count in sorted(report["transitions"].items(), key=lambda item: -item[1]):
+            print(f"  {old} -> {new}: {count}")
+        verb = "updated" if args.apply else "would change"
+        print(f"{report['changed']} rows {verb}")
+
+    elif args.command == "tune":
+        import tuning
+        rules = classifier.scoring_rules
+        db = persistence.init_db(args.db)
+        labels = tuning.load_labels(db, FeatureStore(args.store or feature_store_path(args.db)))
+        db.close()
+        if not len(labels.judged):
+            parser.error("no feedback linked to stored features yet, nothing to tune against")
+
+        if args.grid:
+            grid = {}
+            for spec in args.grid:
+                # split on the last "=": parameter names end in a comparator, which may itself contain "="
+                param, _, span = spec.rpartition("=")
+                try:
+                    low, high, steps = span.split(":")
+                    grid[param] = [float(v) for v in np.linspace(float(low), float(high), int(steps))]
+                except ValueError:
+                    parser.error(f"--grid expects PARAM=LO:HI:STEPS, got {spec}")
+                if param not in rules.params:
+                    parser.error(f"unknown rule parameter {param}, one of: {', '.join(rules.params)}")
+            configs = tuning.grid_configs(grid)
+        else:
+            unknown = set(args.param or ()) - set(rules.params)
+            if unknown:
+                parser.error(f"unknown rule parameter {', '.join(sorted(unknown))}, one of: {', '.join(rules.params)}")
+            configs = tuning.random_configs(rules, args.samples, args.spread, args.param, args.seed)
+
+        start = time.perf_counter()
+        accuracy = tuning.search(labels, configs, args.workers)
+        elapsed = time.perf_counter() - start
+        total = len(accuracy)
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(f"{len(labels.judged)} feedback labels, current rules agree with {tuning.baseline(labels):.1%}")
+        print(f"Tried {total} threshold sets in {elapsed:.2f}s ({rate:,.0f} sets/s)")
+        ranked = tuning.best_configs(configs, accuracy, args.top)
+        for i, (agree, thresholds) in enumerate(ranked):
+            print(f"  #{i + 1}: {agree:.1%}")
+            # the first set in full, the rest are usually close variations of it
+            if i == 0:
+                width = max(map(len, thresholds)) + 2
+                for param, value in thresholds.items():
+                    print(f"      {param:<{width}}{rules.params[param]:>9.4g} -> {value:.4g}")
+        if args.output and ranked:
+            rules.with_thresholds(ranked[0][1]).to_file(args.output)
+            print(f"Wrote {args.output}, use it with: python cli.py --rules {args.output} ...")
+
+    elif args.command == "classify-video":
+        import video
+        paths = [p for path in args.paths
+                 for p in (iter_files(path, video.VIDEO_EXTENSIONS) if os.path.isdir(path) else [path])]
+        totals = {"items": 0, "video_seconds": 0.0, "elapsed": 0.0}
+        # items are averaged over many frames, so no single feature vector stands for them in the feature store
+        with persistence.WriteBehindWriter(persistence.DEFAULT_DB_PATH) as writer:
+            for path in paths:
+                start = time.perf_counter()
+                try:
+                    items, stats = video.classify_video(path, args.description, args.sample_fps, args.window,
+                                                        args.min_seconds, args.presence)
+                except Exception as e:
+                    print("OpenCV Error:", e)
+                    continue
+                elapsed = time.perf_counter() - start
+                print(f"{path}: {len(items)} items, {stats['video_seconds']:.1f}s of video, "
+                      f"{stats['sampled']}/{stats['frames']} frames classified in {elapsed:.1f}s "
+                      f"({stats['video_seconds'] / elapsed if elapsed > 0 else 0:.1f}x real time)")
+                for item in items:
+                    clock = video.format_clock(item["start"])
+                    print(f"  {clock}-{video.format_clock(item['end'])} {item['category']:<12}{item['probabilities']}")
+                    if not args.dry_run:
+                        writer.insert_history(args.user, item["category"],
+                                              history_item_name(f"{path} @ {clock}", args.description))
+                totals["items"] += len(items)
+                totals["video_seconds"] += stats["video_seconds"]
+                totals["elapsed"] += elapsed
+        if len(paths) > 1:
+            print(f"{totals['items']} items in {totals['video_seconds']:.1f}s of video, processed in {totals['elapsed']:.1f}s")
+
+    elif args.command == "classify-regions":
+        import regions
+        try:
+            rows, cols = (int(n) for n in args.grid.lower().split("x"))
+        except ValueError:
+            parser.error(f"--grid expects ROWSxCOLS, got {args.grid}")
+        start = time.perf_counter()
+        result = regions.classify_regions(args.path, rows, cols, args.description, args.window, args.stride)
+        elapsed = time.perf_counter() - start
+        if result is None:
+            parser.error(f"cannot read image {args.path}")
+        boxes, percents, categories = result
+
+        if args.window:
+            # too many overlapping windows to list, summarize how much of the image each category took
+            counts = {category: categories.count(category) for category in dict.fromkeys(categories)}
+            print(f"{len(boxes)} windows: " + ", ".join(f"{c} {n}" for c, n in sorted(counts.items(), key=lambda i: -i[1])))
+        else:
+            width = max(len(c) for c in categories) + 2
+            for r in range(rows):
+                print("".join(f"{c:<{width}}" for c in categories[r * cols:(r + 1) * cols]).rstrip())
+        print(f"Classified {len(boxes)} regions in {elapsed * 1000:.0f} ms")
+
+        if args.output:
+            img = cv2.imread(args.path)
+            if args.window:
+                stride = args.stride or max(1, args.window // 2)
+                # windows overlap, tint the centre of each one instead so every pixel is painted once
+                scale = boxes[0, 2] - boxes[0, 0]
+                cells = regions.centre_cells(boxes, max(1, round(scale * stride / args.window)))
+                img = regions.draw_regions(img, cells, categories, percents, alpha=0.45, labels=False)
+            else:
+                img = regions.draw_regions(img, boxes, categories, percents)
+            cv2.imwrite(args.output, img)
+            print(f"Wrote {args.output}")
+
+    elif args.command in ("export", "report"):
+        import reporting
+        for day in (args.since, args.until):
+            if day:
+                try:
+                    reporting.day_start(day)
+                except ValueError:
+                    parser.error(f"dates are YYYY-MM-DD, got {day}")
+        if not os.path.exists(args.db):
+            parser.error(f"no database at {args.db}")
+        db = persistence.init_db(args.db)
+        out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+        start = time.perf_counter()
+        try:
+            if args.command == "export":
+                if args.table == "eco_points" and (args.since or args.until):
+                    parser.error("eco_points has no dates, --since/--until only apply to history and feedback")
+                rows = reporting.export_table(db, args.table, out, args.format, args.since, args.until, args.chunk_size)
+            else:
+                rows = reporting.write_report(db, args.report, out, args.format, args.since, args.until)
+        except BrokenPipeError:
+            # piped into head or similar, which stopped reading: not an error. Point stdout at devnull
+            # so flushing it on exit doesn't raise again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        finally:
+            if args.output:
+                out.close()
+            db.close()
+        elapsed = time.perf_counter() - start
+        # the rows may be on stdout, keep the summary out of them
+        print(f"{rows} rows in {elapsed:.1f}s", file=sys.stderr)
+
+    elif args.command == "bench-decode":
+        paths = list(iter_files(args.path)) if os.path.isdir(args.path) else [args.path]
+        bench_decode_paths(paths, args.repeat)
+
+
+if __name__ == "__main__":
+    run_cli(sys.argv[1:])
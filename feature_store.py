@@ -0,0 +1,140 @@
+"""Append-only, memory-mapped store of the features behind each history row.
+
+Every classification that extracts features appends one fixed-size record: the history row id, the
+description's keyword hits and the ten ImageFeatures values. Rescoring maps the file and runs the
+vectorized rules over it, so changing a threshold can be checked against all of history without
+decoding a single image.
+"""
+import os
+import struct
+import threading
+
+import numpy as np
+
+from classifier import CATEGORIES, ImageFeatures, keyword_hit_matrix, score_features_matrix
+
+FILE_MAGIC = b"SORTFEAT"
+
+# float64 so a stored ratio compares against a threshold exactly like the live classifier's value.
+# align=True puts every float on an 8 byte boundary, the fields are read as strided memmap columns
+RECORD_DTYPE = np.dtype([("history_id", "<i8"), ("keyword_hits", "u1")] +
+                        [(name, "<f8") for name in ImageFeatures._fields], align=True)
+HEADER = FILE_MAGIC + struct.pack("<Q", RECORD_DTYPE.itemsize)
+
+
+def default_path(db_path):
+    # lives next to the database: sortify.db -> sortify.features
+    return os.path.splitext(db_path)[0] + ".features"
+
+
+class FeatureStore:
+    """One file of RECORD_DTYPE records after a 16 byte header.
+
+    Each append is a single O_APPEND write, so records from concurrent writers never interleave,
+    and a record torn by a crash is cut off the next time the file is opened.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            # O_EXCL so only one of several processes starting together writes the header
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o644)
+        except FileExistsError:
+            self._check()
+        else:
+            os.write(fd, HEADER)
+            os.close(fd)
+
+    def _check(self):
+        with open(self.path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if f.read(len(HEADER)) != HEADER:
+                raise ValueError(f"{self.path} is not a feature store for this version of Sortify")
+            torn = (size - len(HEADER)) % RECORD_DTYPE.itemsize
+            if torn:
+                f.truncate(size - torn)
+
+    def __len__(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        return max(0, size - len(HEADER)) // RECORD_DTYPE.itemsize
+
+    def append(self, rows):
+        """rows: [(history_id, ImageFeatures, description), ...]"""
+        if not rows:
+            return
+        records = np.zeros(len(rows), RECORD_DTYPE)
+        records["history_id"] = [history_id for history_id, _, _ in rows]
+        hits = keyword_hit_matrix([description for _, _, description in rows])
+        records["keyword_hits"] = (hits << np.arange(len(CATEGORIES))).sum(axis=1)
+        for name, column in zip(ImageFeatures._fields, zip(*(features for _, features, _ in rows))):
+            records[name] = column
+
+        with self.lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+            try:
+                data = memoryview(records.tobytes())
+                while data:
+                    data = data[os.write(fd, data):]
+            finally:
+                os.close(fd)
+
+    def records(self):
+        """Read-only memmap of every complete record"""
+        rows = len(self)
+        if rows == 0:
+            return np.zeros(0, RECORD_DTYPE)
+        return np.memmap(self.path, RECORD_DTYPE, mode="r", offset=len(HEADER), shape=(rows,))
+
+
+def features_of(records):
+    """ImageFeatures whose fields are the (strided, zero-copy) columns of a block of records"""
+    return ImageFeatures(*(records[name] for name in ImageFeatures._fields))
+
+def keyword_hits_of(records):
+    # the stored bitmask back into an (N, 4) bool matrix in CATEGORIES order
+    return (records["keyword_hits"][:, None] >> np.arange(len(CATEGORIES)) & 1).astype(bool)
+
+
+# ---- RESCORING ----
+
+def rescore(db, store, chunk_rows=1 << 20, apply=False):
+    """Re-run the current scoring rules over every stored feature record and compare with history.
+
+    Returns {"rows", "matched", "changed", "transitions": {(old, new): count}}. With apply=True the
+    changed history rows are updated in one transaction (the user_stats triggers follow along).
+    """
+    records = store.records()
+    new = np.empty(len(records), np.int64)
+    for start in range(0, len(records), chunk_rows):
+        block = records[start:start + chunk_rows]
+        _, new[start:start + chunk_rows] = score_features_matrix(features_of(block), keyword_hits_of(block))
+
+    # join on history id: both sides sorted, then one searchsorted instead of a query per row
+    history = db.execute("SELECT id, category FROM history ORDER BY id").fetchall()
+    history_ids = np.fromiter((row[0] for row in history), np.int64, len(history))
+    category_index = {category: i for i, category in enumerate(CATEGORIES)}
+    old = np.fromiter((category_index.get(row[1], -1) for row in history), np.int64, len(history))
+
+    ids = np.asarray(records["history_id"])
+    pos = np.minimum(np.searchsorted(history_ids, ids), max(len(history_ids) - 1, 0))
+    # rows deleted from history, or with a category the rules can't produce, are left out
+    matched = (history_ids[pos] == ids) & (old[pos] >= 0) if len(history_ids) else np.zeros(len(ids), bool)
+    old_matched, new_matched = old[pos][matched], new[matched]
+
+    pairs = old_matched * len(CATEGORIES) + new_matched
+    counts = np.bincount(pairs, minlength=len(CATEGORIES) ** 2)
+    transitions = {(CATEGORIES[i // len(CATEGORIES)], CATEGORIES[i % len(CATEGORIES)]): int(n)
+                   for i, n in enumerate(counts) if n and i // len(CATEGORIES) != i % len(CATEGORIES)}
+
+    changed = old_matched != new_matched
+    if apply and changed.any():
+        updates = zip((CATEGORIES[i] for i in new_matched[changed]), ids[matched][changed].tolist())
+        with db:
+            db.executemany("UPDATE history SET category = ? WHERE id = ?", updates)
+
+    return {"rows": len(records), "matched": int(matched.sum()), "changed": int(changed.sum()),
+            "transitions": transitions}
@@ -0,0 +1,247 @@
+"""Watched-folder ingest: python cli.py watch <folder>
+
+A scanner polls the folder and feeds new images through three stages connected by bounded queues:
+
+    scan -> [decode queue] -> decode x N -> [classify queue] -> classify x M -> [write queue] -> write x 1
+
+When a stage falls behind its input queue fills up and the stage before it blocks, so memory stays
+bounded however many files land at once. The writer commits history rows together with their
+ingest_checkpoint entries, so a restart picks up exactly where the last commit left off.
+"""
+import os
+import queue
+import threading
+import time
+
+import persistence
+from classifier import classify_images, history_item_name, iter_files, load_image
+from feature_store import FeatureStore, default_path as feature_store_path
+
+_STOP = object()
+
+
+class IngestPipeline:
+    def __init__(self, watch_dir, username="scanner", description="", db_path=persistence.DEFAULT_DB_PATH,
+                 decode_workers=2, classify_workers=2, queue_size=64, batch_size=100, classify_batch=8,
+                 flush_interval=1.0, poll_interval=2.0, settle=2.0):
+        self.watch_dir = watch_dir
+        self.username = username
+        self.description = description
+        self.db_path = db_path
+        self.feature_store = FeatureStore(feature_store_path(db_path))
+        self.decode_workers = decode_workers
+        self.classify_workers = classify_workers
+        self.batch_size = batch_size
+        self.classify_batch = classify_batch
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        # files modified less than settle seconds ago may still be being written by the scanner
+        self.settle = settle
+
+        self.queues = {
+            "decode": queue.Queue(maxsize=queue_size),
+            "classify": queue.Queue(maxsize=queue_size),
+            "write": queue.Queue(maxsize=queue_size),
+        }
+        self.stats = {"queued": 0, "decoded": 0, "unreadable": 0, "classified": 0, "written": 0, "commits": 0,
+                      "write_errors": 0}
+        self.busy = {"decode": 0.0, "classify": 0.0, "write": 0.0}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.started = time.monotonic()
+        # path -> (size, mtime) for files already checkpointed or somewhere in the pipeline
+        self.seen = {}
+
+    # ---- STAGES ----
+
+    def _count(self, stage, seconds, **counts):
+        with self.lock:
+            self.busy[stage] += seconds
+            for name, n in counts.items():
+                self.stats[name] += n
+
+    def _retry_later(self, path):
+        # an unreadable file is often one still being copied in from a slow share: nothing goes to
+        # history or the checkpoint, and forgetting it lets the next scan try again
+        self.seen.pop(path, None)
+
+    def scan(self):
+        """Queue every settled image that hasn't been ingested yet, returns how many were queued"""
+        queued = 0
+        cutoff = time.time() - self.settle
+        for path in iter_files(self.watch_dir):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signature = (st.st_size, st.st_mtime)
+            if st.st_mtime > cutoff or self.seen.get(path) == signature:
+                continue
+            # blocks while the decode queue is full, this is where backpressure reaches the scanner
+            self.queues["decode"].put((path, signature))
+            self.seen[path] = signature
+            queued += 1
+        with self.lock:
+            self.stats["queued"] += queued
+        return queued
+
+    def _decode_worker(self):
+        while True:
+            item = self.queues["decode"].get()
+            if item is _STOP:
+                return
+            path, signature = item
+            start = time.perf_counter()
+            try:
+                img = load_image(path)
+            except Exception as e:
+                print("OpenCV Error:", e)
+                img = None
+            self._count("decode", time.perf_counter() - start, decoded=1, unreadable=img is None)
+            if img is None:
+                self._retry_later(path)
+                continue
+            self.queues["classify"].put((path, signature, img))
+
+    def _classify_worker(self):
+        inbox = self.queues["classify"]
+        while True:
+            batch = [inbox.get()]
+            # take whatever else is already waiting so the vectorized batch path does the work
+            while batch[-1] is not _STOP and len(batch) < self.classify_batch:
+                try:
+                    batch.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is _STOP
+            if stop:
+                batch.pop()
+
+            if batch:
+                start = time.perf_counter()
+                features = []
+                results = classify_images([img for _, _, img in batch], [self.description] * len(batch), features)
+                failed = sum(f is None for f in features)
+                self._count("classify", time.perf_counter() - start, classified=len(batch) - failed, unreadable=failed)
+                for (path, signature, _), (_, most_likely), f in zip(batch, results, features):
+                    if f is None:
+                        # OpenCV gave up on it, that's the fallback answer and not worth recording
+                        self._retry_later(path)
+                        continue
+                    self.queues["write"].put((path, signature, most_likely, f))
+            if stop:
+                return
+
+    def _write_worker(self):
+        db = persistence.connect(self.db_path)
+        inbox = self.queues["write"]
+        stopping = False
+        while not stopping:
+            item = inbox.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = inbox.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._commit(db, batch)
+        db.close()
+
+    def _commit(self, db, batch):
+        rows = [(self.username, category, history_item_name(path, self.description), path, size, mtime)
+                for path, (size, mtime), category, _ in batch]
+        start = time.perf_counter()
+        try:
+            history_ids = persistence.record_ingested(db, rows)
+        except Exception as e:
+            print("Database Error:", e)
+            # not checkpointed, let the next scan queue these files again
+            for path, _, _, _ in batch:
+                self.seen.pop(path, None)
+            self._count("write", time.perf_counter() - start, write_errors=1)
+            return
+
+        try:
+            self.feature_store.append([(history_id, features, self.description)
+                                       for history_id, (_, _, _, features) in zip(history_ids, batch)])
+        except Exception as e:
+            print("Feature Store Error:", e)
+        self._count("write", time.perf_counter() - start, written=len(batch), commits=1)
+
+    # ---- METRICS ----
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        workers = {"decode": self.decode_workers, "classify": self.classify_workers, "write": 1}
+        with self.lock:
+            stats = dict(self.stats)
+            utilization = {stage: self.busy[stage] / (elapsed * workers[stage]) for stage in self.busy}
+        return {
+            "queues": {name: (q.qsize(), q.maxsize) for name, q in self.queues.items()},
+            "utilization": utilization,
+            # the stage whose workers are busiest is the one holding everything else up
+            "bottleneck": max(utilization, key=utilization.get) if any(utilization.values()) else None,
+            **stats,
+        }
+
+    def report(self):
+        snap = self.snapshot()
+        queues = " ".join(f"{name} {depth}/{size}" for name, (depth, size) in snap["queues"].items())
+        busy = " ".join(f"{stage} {u:.0%}" for stage, u in snap["utilization"].items())
+        print(f"queues: {queues} | decoded {snap['decoded']} classified {snap['classified']} "
+              f"written {snap['written']} unreadable {snap['unreadable']} | busy: {busy} | bottleneck: {snap['bottleneck']}",
+              flush=True)
+
+    def _reporter(self, interval):
+        while not self.stopping.wait(interval):
+            self.report()
+
+    # ---- RUN ----
+
+    def run(self, once=False, report_interval=10.0):
+        """Ingest until interrupted, or just what is in the folder now when once is set"""
+        db = persistence.connect(self.db_path)
+        self.seen = persistence.ingest_checkpoint(db)
+        db.close()
+        self.started = time.monotonic()
+
+        stages = {
+            "decode": [threading.Thread(target=self._decode_worker, name=f"ingest-decode-{i}", daemon=True)
+                       for i in range(self.decode_workers)],
+            "classify": [threading.Thread(target=self._classify_worker, name=f"ingest-classify-{i}", daemon=True)
+                         for i in range(self.classify_workers)],
+            "write": [threading.Thread(target=self._write_worker, name="ingest-write", daemon=True)],
+        }
+        for thread in (t for threads in stages.values() for t in threads):
+            thread.start()
+        if report_interval:
+            threading.Thread(target=self._reporter, args=(report_interval,), name="ingest-report", daemon=True).start()
+
+        try:
+            while True:
+                self.scan()
+                if once or self.stopping.wait(self.poll_interval):
+                    break
+        except KeyboardInterrupt:
+            print("Stopping, finishing files already in the pipeline...")
+
+        # drain stage by stage: each one gets a stop marker per worker once everything before it is done
+        for name, threads in stages.items():
+            for _ in threads:
+                self.queues[name].put(_STOP)
+            for thread in threads:
+                thread.join()
+        self.stopping.set()
+        return self.snapshot()
@@ -1,177 +1,226 @@
 from customtkinter import *
 from tkinter import filedialog, messagebox, StringVar
-from PIL import Image
 import sqlite3
-import cv2
-import numpy as np
 import random
 import os
+import sys
+import itertools
+import queue
+import threading
+
+import persistence
+
+DB_PATH = persistence.DEFAULT_DB_PATH
+PREVIEW_SIZE = (260, 120)
+# longest the GUI waits for queued writes before reading them back, a stuck disk shows stale counts instead of hanging
+FLUSH_TIMEOUT = 5.0
+
+# ---- BACKGROUND WORKER ----
+
+class ClassificationWorker(threading.Thread):
+    """Runs image decoding, classification and the history/points writes off the Tk thread.
+
+    Jobs go in through submit(), results come back on the results queue as (job_id, kind, status, value)
+    and the GUI drains it with root.after. sqlite connections can't cross threads, so the worker
+    opens its own connection and cache.
+    """
+
+    def __init__(self, writer, db_path=DB_PATH, profile=False):
+        super().__init__(daemon=True)
+        self.writer = writer
+        self.db_path = db_path
+        self.profile = profile
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.cancelled = set()
+        self.awarded = set()  # (username, image_path) pairs that already earned classification points
+        self.cache = None
+        self.classifier = None
+        # the selected image, read once and shared by the preview and every classification of it
+        self.handle = None
+        self._ids = itertools.count(1)
+
+    def submit(self, kind, **payload):
+        job_id = next(self._ids)
+        self.jobs.put((job_id, kind, payload))
+        return job_id
+
+    def cancel(self, job_id):
+        if job_id is not None:
+            self.cancelled.add(job_id)
+
+    def stop(self):
+        self.jobs.put(None)
+
+    def run(self):
+        # numpy/OpenCV load here on the worker thread, the login window doesn't wait for them
+        import classifier
+        import feature_store
+        self.classifier = classifier
+        if self.profile:
+            classifier.enable_profiling()
+        # attached here rather than in SortifyApp so numpy isn't imported before the window is up
+        if self.writer.feature_store is None:
+            self.writer.feature_store = feature_store.FeatureStore(feature_store.default_path(self.db_path))
+
+        db = persistence.connect(self.db_path)
+        self.cache = classifier.ClassificationCache(db)
+        handlers = {"preview": self._preview, "classify": self._classify}
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job_id, kind, payload = job
+            if job_id in self.cancelled:
+                self.cancelled.discard(job_id)
+                self.results.put((job_id, kind, "cancelled", payload))
+                continue
+            try:
+                value = handlers[kind](db, job_id, **payload)
+            except Exception as e:
+                print("Worker Error:", e)
+                self.results.put((job_id, kind, "error", e))
+            else:
+                status = "cancelled" if value is None else "done"
+                self.cancelled.discard(job_id)
+                self.results.put((job_id, kind, status, payload if value is None else value))
 
-# ---- DATABASE SETUP ---- 
-conn = sqlite3.connect("sortify.db")
-c = conn.cursor()
-
-#credential table
-c.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
-)
-""")
-
-#history table
-c.execute("""
-CREATE TABLE IF NOT EXISTS history (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT NOT NULL,
-    category TEXT,
-    item TEXT
-)
-""")
-
-#feedback history table
-c.execute("""
-CREATE TABLE IF NOT EXISTS feedback (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT NOT NULL,
-    type TEXT NOT NULL,
-    message TEXT
-)
-""")
-
-# Eco points table for gamification
-c.execute("""
-CREATE TABLE IF NOT EXISTS eco_points (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    points INTEGER DEFAULT 0,
-    FOREIGN KEY (username) REFERENCES users (username)
-)
-""")
-
-conn.commit()
-
-def classify_with_opencv(image_path, description=""):
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return {"Recyclable": 25, "Reusable": 25, "Compostable": 25, "Trash": 25}, "Trash"
-
-        img = cv2.resize(img, (300, 300))
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # Initialize probability scores
-        recyclable_score = reusable_score = compostable_score = trash_score = 0
-
-        # --- Color masks ---
-        green_mask = cv2.inRange(hsv, np.array([30, 40, 40]), np.array([85, 255, 255]))
-        green_ratio = cv2.countNonZero(green_mask) / (300 * 300)
-
-        yellow_mask = cv2.inRange(hsv, np.array([15, 60, 60]), np.array([35, 255, 255]))
-        yellow_ratio = cv2.countNonZero(yellow_mask) / (300 * 300)
-
-        blue_mask = cv2.inRange(hsv, np.array([90, 60, 60]), np.array([130, 255, 255]))
-        blue_ratio = cv2.countNonZero(blue_mask) / (300 * 300)
-
-        brown_mask = cv2.inRange(hsv, np.array([5, 40, 40]), np.array([25, 200, 200]))
-        brown_ratio = cv2.countNonZero(brown_mask) / (300 * 300)
-
-        black_mask = cv2.inRange(hsv, np.array([0, 0, 0]), np.array([180, 255, 40]))
-        black_ratio = cv2.countNonZero(black_mask) / (300 * 300)
-
-        grey_mask = cv2.inRange(hsv, np.array([0, 0, 40]), np.array([180, 40, 180]))
-        grey_ratio = cv2.countNonZero(grey_mask) / (300 * 300)
-
-        _, thresh_white = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-        white_ratio = cv2.countNonZero(thresh_white) / (300 * 300)
-
-        edges = cv2.Canny(gray, 100, 200)
-        edge_ratio = cv2.countNonZero(edges) / (300 * 300)
-
-        texture_variance = np.std(gray)
-        brightness_std = np.std(hsv[:, :, 2])
-
-        # --- Trash detection ---
-        if black_ratio > 0.1 or grey_ratio > 0.18:
-            trash_score += 50
-        elif (black_ratio > 0.07 and (green_ratio + yellow_ratio + brown_ratio) < 0.08):
-            trash_score += 40
-        if brightness_std > 60 and (black_ratio + grey_ratio) > 0.15:
-            trash_score += 25
-
-        # --- Compostable detection ---
-        if green_ratio > 0.12 or yellow_ratio > 0.12 or brown_ratio > 0.1:
-            compostable_score += 40
-        if 20 < texture_variance < 60:
-            compostable_score += 20
-        if compostable_score > trash_score:
-            trash_score = max(0, trash_score - 20)
-
-        # --- Recyclable detection ---
-        if blue_ratio > 0.08:  
-            recyclable_score += 35
-        if white_ratio > 0.15 and texture_variance < 55:  
-            recyclable_score += 30
-        if edge_ratio > 0.18 and texture_variance < 65:  
-            recyclable_score += 20
-
-        # --- Reusable detection ---
-        if edge_ratio > 0.25 and texture_variance < 40 and black_ratio < 0.08:
-            reusable_score += 35
-        if white_ratio > 0.2 and texture_variance < 35:
-            reusable_score += 25
-        if brown_ratio > 0.08 and texture_variance < 45:
-            reusable_score += 15
-
-        # --- Strong keyword detection ---
-        desc = description.lower()
-
-        compostable_keywords = ["moldy", "food", "organic", "banana", "apple", "leaves", "compost", "rotten", "vegetable", "fruit", "bread"]
-        recyclable_keywords = ["plastic", "glass", "metal", "paper", "cardboard", "can"]
-        reusable_keywords = ["container", "tupperware", "box", "jar", "bottle", "good condition", "clean"]
-        trash_keywords = ["dirty", "broken", "damaged", "burnt", "contaminated"]
-
-        if any(word in desc for word in compostable_keywords):
-            compostable_score += 100 
-        if any(word in desc for word in recyclable_keywords):
-            recyclable_score += 100
-        if any(word in desc for word in reusable_keywords):
-            reusable_score += 100
-        if any(word in desc for word in trash_keywords):
-            trash_score += 100
-
-        # Base safeguard
-        recyclable_score += 5
-        reusable_score += 5
-        compostable_score += 5
-        trash_score += 5
-
-        # --- Normalize ---
-        total = recyclable_score + reusable_score + compostable_score + trash_score
-        recyclable_percent = int((recyclable_score / total) * 100)
-        reusable_percent = int((reusable_score / total) * 100)
-        compostable_percent = int((compostable_score / total) * 100)
-        trash_percent = 100 - recyclable_percent - reusable_percent - compostable_percent
-
-        probabilities = {
-            "Recyclable": recyclable_percent,
-            "Reusable": reusable_percent,
-            "Compostable": compostable_percent,
-            "Trash": trash_percent
-        }
+        db.close()
 
-        most_likely = max(probabilities, key=probabilities.get)
+    def _image(self, image_path):
+        # a file edited or replaced since it was read gets read again, not served from the old bytes
+        if self.handle is None or self.handle.path != image_path or not self.handle.unchanged():
+            self.handle = self.classifier.ImageHandle(image_path)
+        return self.handle
 
-        return probabilities, most_likely
+    def _preview(self, db, job_id, image_path):
+        return self._image(image_path).preview(PREVIEW_SIZE)
 
-    except Exception as e:
-        print("OpenCV Error:", e)
-        return {"Recyclable": 25, "Reusable": 25, "Compostable": 25, "Trash": 25}, "Trash"
+    def _classify(self, db, job_id, image_path, description, username):
+        handle = self._image(image_path)
+        probabilities, most_likely = self.classifier.classify_cached(handle, description, self.cache)
 
+        # last chance to cancel, nothing has been written for this job yet
+        if job_id in self.cancelled:
+            return None
 
-#  MAIN APPLICATION CLASS 
+        # a cache hit on a fresh handle has no features, that row just won't be rescorable
+        self.writer.insert_history(username, most_likely, self.classifier.history_item_name(image_path, description),
+                                   features=handle.decoded_features, description=description)
+
+        # Only award points if this is the first classification for this image
+        award_points = (username, image_path) not in self.awarded
+        if award_points:
+            self.awarded.add((username, image_path))
+            points_total = persistence.add_points(db, username, 3)
+        else:
+            points_total = persistence.get_user_points(db, username)
+        return {"probabilities": probabilities, "most_likely": most_likely,
+                "points_total": points_total, "award_points": award_points}
+
+
+# ---- VIRTUALIZED LIST ----
+
+class VirtualList(CTkFrame):
+    """Scrollable list that only ever creates widgets for the rows on screen.
+
+    fetch_page(after_key, limit) returns the next [(key, item), ...] after after_key (None for the first
+    page). Pages are loaded as the user scrolls and the same row widgets are re-labelled for whatever
+    is visible, so memory and startup time don't grow with the number of rows in the table.
+    """
+
+    def __init__(self, master, fetch_page, format_item=str, on_select=None, visible_rows=10, page_size=100,
+                 row_height=36, **kwargs):
+        super().__init__(master, **kwargs)
+        self.fetch_page = fetch_page
+        self.format_item = format_item
+        self.on_select = on_select
+        self.visible_rows = visible_rows
+        self.page_size = page_size
+        self.items = []         # (key, item) pairs loaded so far
+        self.exhausted = False  # True once a short page shows there's nothing more to load
+        self.top = 0            # index of the first visible row
+
+        body = CTkFrame(self, fg_color="transparent")
+        body.pack(side="left", fill="both", expand=True)
+        self.scrollbar = CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.rows = []
+        for i in range(visible_rows):
+            if on_select:
+                row = CTkButton(body, text="", height=row_height - 8, corner_radius=20,
+                                command=lambda i=i: self._select(i))
+            else:
+                row = CTkLabel(body, text="", anchor="w", height=row_height - 8)
+            row.pack(fill="x", pady=2, padx=5)
+            self.rows.append(row)
+
+        for widget in [body] + self.rows:
+            widget.bind("<MouseWheel>", self._on_wheel)
+            widget.bind("<Button-4>", lambda e: self.scroll_to(self.top - 3))
+            widget.bind("<Button-5>", lambda e: self.scroll_to(self.top + 3))
+
+        self.reset()
+
+    def reset(self, fetch_page=None):
+        # start over, e.g. when the search text changes
+        if fetch_page is not None:
+            self.fetch_page = fetch_page
+        self.items = []
+        self.exhausted = False
+        self.scroll_to(0)
+
+    def _ensure_loaded(self, count):
+        while len(self.items) < count and not self.exhausted:
+            after = self.items[-1][0] if self.items else None
+            page = self.fetch_page(after, self.page_size)
+            self.items.extend(page)
+            if len(page) < self.page_size:
+                self.exhausted = True
+
+    def scroll_to(self, top):
+        top = max(0, int(top))
+        # one extra row tells us whether there is anything past the bottom of the window
+        self._ensure_loaded(top + self.visible_rows + 1)
+        self.top = max(0, min(top, len(self.items) - self.visible_rows))
+        self._render()
+
+    def _render(self):
+        for i, row in enumerate(self.rows):
+            index = self.top + i
+            if index < len(self.items):
+                row.configure(text=self.format_item(self.items[index][1]))
+                if self.on_select:
+                    row.configure(state="normal")
+            else:
+                row.configure(text="")
+                if self.on_select:
+                    row.configure(state="disabled")
+
+        # until the last page is loaded the scrollbar only measures what has been fetched so far
+        total = max(len(self.items), 1)
+        self.scrollbar.set(self.top / total, min(1.0, (self.top + self.visible_rows) / total))
+
+    def _on_scrollbar(self, *args):
+        # tk scrollbar protocol: ("moveto", fraction) or ("scroll", amount, "units" | "pages")
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            step = int(args[1]) * (self.visible_rows if args[2] == "pages" else 1)
+            self.scroll_to(self.top + step)
+
+    def _on_wheel(self, event):
+        self.scroll_to(self.top - (1 if event.delta > 0 else -1) * 3)
+
+    def _select(self, i):
+        index = self.top + i
+        if index < len(self.items):
+            self.on_select(self.items[index][0])
+
+
+#  MAIN APPLICATION CLASS
 
 class SortifyApp:
     def __init__(self):
@@ -185,10 +234,28 @@ class SortifyApp:
 
         self.current_user = None  # Tracks logged-in user
         self.image_path = None    # Stores path to selected image
-        self.points_awarded_for_current_image = False  # Track if points were awarded for current image
+        self.has_classified = False  # feedback is linked to a classification once there is one
+
+        # the database is opened here rather than at import so the core modules stay side-effect free
+        self.db = persistence.init_db(DB_PATH)
+
+        # history and feedback rows are queued and group-committed in the background
+        self.writer = persistence.WriteBehindWriter(DB_PATH)
+
+        # decoding, classification and db writes happen on this thread so the window never freezes
+        # SORTIFY_PROFILE=1 records per-stage classifier timings, shown in the admin dashboard
+        self.worker = ClassificationWorker(self.writer, profile=bool(os.environ.get("SORTIFY_PROFILE")))
+        self.worker.start()
+        self.pending_preview = None
+        self.pending_classify = None
 
         self.login_page()
+        self.root.after(50, self.poll_worker)
         self.root.mainloop()
+        self.worker.stop()
+        self.worker.join()
+        self.writer.close()
+        self.db.close()
 
     def clear_window(self):
         #helpr function to remove all widgets before switching pages
@@ -196,22 +263,10 @@ class SortifyApp:
             widget.destroy()
 
     def get_user_points(self, username):
-        c.execute("SELECT points FROM eco_points WHERE username=?", (username,))
-        result = c.fetchone()
-        return result[0] if result else 0
+        return persistence.get_user_points(self.db, username)
 
     def add_points(self, username, points):
-        c.execute("SELECT points FROM eco_points WHERE username=?", (username,))
-        result = c.fetchone()
-        
-        if result:
-            new_points = result[0] + points
-            c.execute("UPDATE eco_points SET points=? WHERE username=?", (new_points, username))
-        else:
-            c.execute("INSERT INTO eco_points (username, points) VALUES (?, ?)", (username, points))
-        
-        conn.commit()
-        return self.get_user_points(username)
+        return persistence.add_points(self.db, username, points)
 
     def update_points_display(self):
         """Update the points display in the UI"""
@@ -301,8 +356,14 @@ class SortifyApp:
         self.desc_box = CTkTextbox(leftPanel, height=40, width=260)
         self.desc_box.pack(pady=5)
 
-        CTkButton(leftPanel, text="Classify Item", fg_color="#0e9a46", width=200, corner_radius=25, 
-                  command=self.classify_item).pack(pady=15)
+        self.classify_button = CTkButton(leftPanel, text="Classify Item", fg_color="#0e9a46", width=200, corner_radius=25, 
+                                         command=self.classify_item)
+        self.classify_button.pack(pady=15)
+
+        # shown only while a classification is running
+        self.progress = CTkProgressBar(leftPanel, mode="indeterminate", width=200)
+        self.cancel_button = CTkButton(leftPanel, text="Cancel", hover_color="#b01b1b", width=120, corner_radius=25,
+                                       command=self.cancel_classification)
                   
         CTkButton(leftPanel, text="Generate Fun Fact!", fg_color="#0e9a46", width=200, corner_radius=25, 
                   command=self.generate_fun_fact).pack(pady=5)
@@ -372,45 +433,202 @@ class SortifyApp:
         CTkButton(self.root, text="Logout", hover_color="#b01b1b", width=120, corner_radius=25,
                   command=self.logout).pack(side="top", padx=20, pady=10)
 
-        frame = CTkScrollableFrame(self.root, width=700, height=500)
+        # the worker builds its cache once its thread is running
+        cache = self.worker.cache
+        if cache is not None:
+            stats = cache.snapshot()
+            CTkLabel(self.root, text=f"Classification cache: {stats['lookups']} lookups, {stats['hit_rate']:.0%} hit rate, "
+                                     f"{stats['disk_entries']} stored", font=("Arial",12)).pack()
+
+        CTkButton(self.root, text="Reports", width=160, corner_radius=25, command=self.view_reports).pack(pady=5)
+
+        if self.worker.classifier is not None and self.worker.classifier.profiler is not None:
+            CTkButton(self.root, text="Classifier Profile", width=160, corner_radius=25,
+                      command=self.view_profile).pack(pady=5)
+
+        frame = CTkFrame(self.root, width=700, height=500)
         frame.pack(padx=20, pady=20, fill="both", expand=True)
 
         CTkLabel(frame, text="All users", font=("Arial", 25, "bold")).pack(padx=10, pady=10)
 
-        # Fetch and display all registered users
-        c.execute("SELECT username FROM users")
-        users = c.fetchall()
+        self.user_search = CTkEntry(frame, placeholder_text="Search usernames...", width=300, height=35, corner_radius=20)
+        self.user_search.pack(pady=5)
+        self.user_search.bind("<KeyRelease>", self.schedule_user_search)
+        self._search_job = None
+
+        # only the visible rows exist as widgets, users are paged in from the username index
+        self.user_list = VirtualList(frame, self.user_page_fetcher(""), on_select=self.view_user_details,
+                                     visible_rows=10, fg_color="transparent")
+        self.user_list.pack(padx=10, pady=10, fill="both", expand=True)
+
+    def user_page_fetcher(self, prefix):
+        return lambda after, limit: persistence.users_page(self.db, after, prefix, limit)
 
-        for u in users:
-            username = u[0]
-            # Lambda fucntion to bind username to button command
-            btn = CTkButton(frame, text=username, width=200, corner_radius=20,
-                            command=lambda user=username: self.view_user_details(user))
-            btn.pack(pady=5)
+    def schedule_user_search(self, event=None):
+        # wait for a pause in typing before querying
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(200, self.run_user_search)
+
+    def run_user_search(self):
+        self._search_job = None
+        if self.user_list.winfo_exists():
+            self.user_list.reset(self.user_page_fetcher(self.user_search.get().strip()))
 
     def view_user_details(self, username):
         details = CTkToplevel(self.root)
         details.title(f"Details - {username}")
         details.geometry("600x500")
 
-        c.execute("SELECT type, COUNT(*) FROM feedback WHERE username=? GROUP BY type", (username,))
-        feedback_counts = dict(c.fetchall())  
-        
-        correct_count = feedback_counts.get("Correct", 0)
-        incorrect_count = feedback_counts.get("Incorrect", 0)
-
-        c.execute("SELECT type, message FROM feedback WHERE username=?", (username,))
-        messages = c.fetchall()
-
         CTkLabel(details, text=f"User: {username}", font=("Arial",20,"bold")).pack(pady=10)
-        CTkLabel(details, text=f"Correct Feedback: {correct_count}", font=("Arial",14)).pack(pady=5)
-        CTkLabel(details, text=f"Incorrect Feedback: {incorrect_count}", font=("Arial",14)).pack(pady=5)
-
-        msg_frame = CTkScrollableFrame(details, width=500, height=250)
-        msg_frame.pack(pady=10, padx=10, fill="both", expand=True)
-
-        for ftype, msg in messages:
-            CTkLabel(msg_frame, text=f"[{ftype}] {msg}", anchor="w").pack(fill="x", pady=2, padx=5)
+        correct_label = CTkLabel(details, text="Correct Feedback: ...", font=("Arial",14))
+        correct_label.pack(pady=5)
+        incorrect_label = CTkLabel(details, text="Incorrect Feedback: ...", font=("Arial",14))
+        incorrect_label.pack(pady=5)
+        classified_label = CTkLabel(details, text="Classified Items - loading...", font=("Arial",12))
+        classified_label.pack(pady=5)
+
+        def load(db):
+            # make sure queued feedback is visible before reading it back, off the Tk thread since the
+            # writer may be waiting on a busy database
+            self.writer.flush(timeout=FLUSH_TIMEOUT)
+            # counts come from the trigger-maintained summary table, no scan of feedback/history
+            return persistence.user_stats(db, username, "feedback"), persistence.user_stats(db, username, "history")
+
+        def show(result):
+            if not details.winfo_exists():
+                return
+            if "error" in result:
+                classified_label.configure(text=f"Loading failed: {result['error']}")
+                return
+            feedback_counts, history_counts = result["value"]
+            correct_label.configure(text=f"Correct Feedback: {feedback_counts.get('Correct', 0)}")
+            incorrect_label.configure(text=f"Incorrect Feedback: {feedback_counts.get('Incorrect', 0)}")
+
+            from classifier import CATEGORIES
+            classified = ", ".join(f"{category}: {history_counts.get(category, 0)}" for category in CATEGORIES)
+            classified_label.configure(text=f"Classified Items - {classified}")
+
+            # feedback messages are paged in as the list scrolls instead of one label per message
+            msg_list = VirtualList(details, lambda after, limit: persistence.feedback_page(self.db, username, after, limit),
+                                   format_item=lambda item: f"[{item[0]}] {item[1]}", visible_rows=8, width=500)
+            msg_list.pack(pady=10, padx=10, fill="both", expand=True)
+
+        self.run_in_background(load, show)
+
+    def view_profile(self):
+        import profiling
+        profiler = self.worker.classifier.profiler
+
+        window = CTkToplevel(self.root)
+        window.title("Classifier Profile")
+        window.geometry("600x450")
+
+        report = CTkTextbox(window, font=("Courier",12), width=560, height=340)
+        report.pack(padx=10, pady=10, fill="both", expand=True)
+
+        def refresh():
+            report.configure(state="normal")
+            report.delete("1.0", "end")
+            report.insert("1.0", profiling.format_report(profiler.snapshot()))
+            report.configure(state="disabled")
+
+        def save():
+            path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")])
+            if path:
+                profiler.dump(path)
+
+        buttons = CTkFrame(window, fg_color="transparent")
+        buttons.pack(pady=5)
+        CTkButton(buttons, text="Refresh", width=100, command=refresh).pack(side="left", padx=5)
+        CTkButton(buttons, text="Save...", width=100, command=save).pack(side="left", padx=5)
+        CTkButton(buttons, text="Reset", width=100, command=lambda: (profiler.reset(), refresh())).pack(side="left", padx=5)
+        refresh()
+
+    def run_in_background(self, job, done):
+        # job(db) runs on its own thread and connection, done(result) back on the Tk thread.
+        # For reports and exports, which can read millions of rows, and anything that waits on the writer
+        result = {}
+
+        def target():
+            try:
+                db = persistence.connect(DB_PATH)
+                try:
+                    result["value"] = job(db)
+                finally:
+                    db.close()
+            except Exception as e:
+                print("Database Error:", e)
+                result["error"] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+
+        def poll():
+            if thread.is_alive():
+                self.root.after(100, poll)
+            else:
+                done(result)
+        poll()
+
+    def view_reports(self):
+        import io
+        import time
+        import reporting
+
+        window = CTkToplevel(self.root)
+        window.title("Reports")
+        window.geometry("640x520")
+
+        report = CTkTextbox(window, font=("Courier",12), width=600, height=380)
+        report.pack(padx=10, pady=10, fill="both", expand=True)
+        status = CTkLabel(window, text="Loading...", font=("Arial",12))
+        status.pack()
+
+        since = time.strftime("%Y-%m-%d", time.localtime(time.time() - 30 * 86400))
+
+        def build(db):
+            # make sure queued history and feedback are in the database before aggregating
+            self.writer.flush(timeout=FLUSH_TIMEOUT)
+            # aggregated inside SQLite, only the summary rows come back
+            out = io.StringIO()
+            out.write("Incorrect feedback by category shown\n")
+            reporting.write_report(db, "feedback", out)
+            out.write(f"\nClassifications per day since {since}\n")
+            reporting.write_report(db, "daily", out, since=since)
+            return out.getvalue()
+
+        def show(result):
+            if not window.winfo_exists():
+                return
+            report.insert("1.0", result.get("value", ""))
+            report.configure(state="disabled")
+            status.configure(text=f"Report failed: {result['error']}" if "error" in result else "")
+
+        def export(table):
+            path = filedialog.asksaveasfilename(parent=window, initialfile=f"{table}.csv", defaultextension=".csv",
+                                                filetypes=[("CSV", "*.csv"), ("JSON lines", "*.jsonl")])
+            if not path:
+                return
+            fmt = "jsonl" if path.lower().endswith(".jsonl") else "csv"
+
+            def job(db):
+                with open(path, "w", newline="", encoding="utf-8") as out:
+                    return reporting.export_table(db, table, out, fmt)
+
+            def finished(result):
+                if window.winfo_exists():
+                    status.configure(text=f"Export failed: {result['error']}" if "error" in result
+                                     else f"Exported {result['value']} {table} rows to {os.path.basename(path)}")
+
+            status.configure(text=f"Exporting {table}...")
+            self.run_in_background(job, finished)
+
+        buttons = CTkFrame(window, fg_color="transparent")
+        buttons.pack(pady=5)
+        for table, label in (("history", "Export History"), ("feedback", "Export Feedback"), ("eco_points", "Export Eco Points")):
+            CTkButton(buttons, text=label, width=140, command=lambda t=table: export(t)).pack(side="left", padx=5)
+        self.run_in_background(build, show)
 
     # -- FUNCTIONALITY METHODS -- 
     
@@ -422,16 +640,12 @@ class SortifyApp:
         
         if self.image_path:
             # Reset points flag for new image
-            self.points_awarded_for_current_image = False
-            
-            try:
-                img = Image.open(self.image_path)
-                ctk_img = CTkImage(light_image=img, dark_image=img, size=(260, 120)) #load and resize the image for preview
-                self.preview_label.configure(image=ctk_img, text="")
-                self.preview_label.image = ctk_img  # Keep reference
-            except Exception as e:
-                self.preview_label.configure(text="Error loading image")
-                print("Error:", e)
+            self.worker.awarded.discard((self.current_user, self.image_path))
+
+            # decode the preview on the worker, only the newest selection matters
+            self.worker.cancel(self.pending_preview)
+            self.preview_label.configure(image=None, text="Loading preview...")
+            self.pending_preview = self.worker.submit("preview", image_path=self.image_path)
 
     def classify_item(self):
         if not self.image_path:
@@ -439,8 +653,68 @@ class SortifyApp:
             return
 
         description = self.desc_box.get("1.0","end").strip()
-        
-        probabilities, most_likely_category = classify_with_opencv(self.image_path, description)
+
+        # a newer request replaces one that hasn't finished yet
+        self.worker.cancel(self.pending_classify)
+        self.pending_classify = self.worker.submit("classify", image_path=self.image_path, description=description,
+                                                   username=self.current_user)
+        self.set_busy(True)
+
+    def cancel_classification(self):
+        self.worker.cancel(self.pending_classify)
+
+    def set_busy(self, busy):
+        if not hasattr(self, "progress"):
+            return
+        if busy:
+            self.result_label.configure(text="Classifying...")
+            self.progress.pack(after=self.classify_button, pady=(0, 5))
+            self.progress.start()
+            self.cancel_button.pack(after=self.progress, pady=(0, 5))
+        else:
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.cancel_button.pack_forget()
+
+    def poll_worker(self):
+        # runs on the Tk thread, drains whatever the worker has finished since the last tick
+        try:
+            while True:
+                job_id, kind, status, value = self.worker.results.get_nowait()
+                if kind == "preview" and job_id == self.pending_preview:
+                    self.pending_preview = None
+                    self.show_preview(status, value)
+                elif kind == "classify" and job_id == self.pending_classify:
+                    self.pending_classify = None
+                    self.set_busy(False)
+                    self.show_classification(status, value)
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_worker)
+
+    def show_preview(self, status, value):
+        if not hasattr(self, "preview_label") or not self.preview_label.winfo_exists():
+            return
+        if status == "done":
+            ctk_img = CTkImage(light_image=value, dark_image=value, size=PREVIEW_SIZE)
+            self.preview_label.configure(image=ctk_img, text="")
+            self.preview_label.image = ctk_img  # Keep reference
+        elif status == "error":
+            self.preview_label.configure(text="Error loading image")
+
+    def show_classification(self, status, value):
+        if not hasattr(self, "result_label") or not self.result_label.winfo_exists():
+            return
+        if status == "cancelled":
+            self.result_label.configure(text="Classification cancelled")
+            return
+        if status == "error":
+            self.result_label.configure(text="Category: —")
+            messagebox.showerror("Error", f"Classification failed: {value}")
+            return
+
+        probabilities = value["probabilities"]
+        most_likely_category = value["most_likely"]
 
         # Update result display
         self.result_label.configure(text=f"Most Likely: {most_likely_category}")
@@ -452,24 +726,12 @@ class SortifyApp:
         tip = self.get_eco_tip(most_likely_category)
         self.tip_label.configure(text=tip)
 
-        item_name = os.path.basename(self.image_path) 
-        if description:
-            item_name = f"{item_name} ({description})"
-
-        c.execute("INSERT INTO history (username, category, item) VALUES (?, ?, ?)",
-                  (self.current_user, most_likely_category, item_name))
-        conn.commit()
-
-        # Only award points if this is the first classification for this image
-        points_message = ""
-        if not self.points_awarded_for_current_image:
-            new_points_total = self.add_points(self.current_user, 3)
+        self.has_classified = True
+        if value["award_points"]:
             self.update_points_display()
-            self.points_awarded_for_current_image = True
-            points_message = f"\n\n +3 Eco Points! Total: {new_points_total}"
+            points_message = f"\n\n +3 Eco Points! Total: {value['points_total']}"
         else:
-            current_points = self.get_user_points(self.current_user)
-            points_message = f"\n\n(Points already awarded for this image. Total: {current_points})"
+            points_message = f"\n\n(Points already awarded for this image. Total: {value['points_total']})"
 
         # Create probability display string for messagebox
         prob_text = f"Recyclable: {probabilities['Recyclable']}%\nReusable: {probabilities['Reusable']}%\nCompostable: {probabilities['Compostable']}%\nTrash: {probabilities['Trash']}%"
@@ -510,9 +772,8 @@ class SortifyApp:
         feedback_msg = self.feedback_text.get("1.0","end").strip()  # Get text content
         
         if feedback_msg:
-            c.execute("INSERT INTO feedback (username, type, message) VALUES (?, ?, ?)",
-                      (self.current_user, feedback_type, feedback_msg))
-            conn.commit()
+            self.writer.insert_feedback(self.current_user, feedback_type, feedback_msg,
+                                        about_last_history=self.has_classified)
             
             new_points_total = self.add_points(self.current_user, 1)
             self.update_points_display()
@@ -531,8 +792,7 @@ class SortifyApp:
             self.admin_window() 
             return
 
-        c.execute("SELECT 1 FROM users WHERE username=? AND password=?", (user, pw))
-        if c.fetchone(): 
+        if self.db.execute("SELECT 1 FROM users WHERE username=? AND password=?", (user, pw)).fetchone():
             self.current_user = user
             self.main_window()  # Route to main application
         else:
@@ -547,8 +807,8 @@ class SortifyApp:
             return
 
         try:
-            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (user, pw))
-            conn.commit()
+            self.db.execute("INSERT INTO users (username, password) VALUES (?, ?)", (user, pw))
+            self.db.commit()
             messagebox.showinfo("Success", "Account created successfully!")
             self.current_user = user  # Set current user after successful registration
             self.main_window()  # Route to main application
@@ -559,15 +819,23 @@ class SortifyApp:
 
     def logout(self):
         # Reset application state
+        self.worker.cancel(self.pending_preview)
+        self.worker.cancel(self.pending_classify)
+        self.pending_preview = None
+        self.pending_classify = None
         self.current_user = None
         self.image_path = None
-        self.points_awarded_for_current_image = False
+        self.has_classified = False
 
         # Return to login screen
         self.root.geometry("500x500")
         self.login_page()
 
 
-
 if __name__ == "__main__":
-    SortifyApp()
+    if len(sys.argv) > 1:
+        # headless tools live in cli.py, kept here so `python main.py classify-dir ...` keeps working
+        from cli import run_cli
+        run_cli(sys.argv[1:])
+    else:
+        SortifyApp()
@@ -0,0 +1,436 @@
+import sqlite3
+import queue
+import threading
+import time
+
+# ---- CONNECTIONS ----
+
+DEFAULT_DB_PATH = "sortify.db"
+
+
+def init_db(path=DEFAULT_DB_PATH):
+    """Open (creating and migrating if needed) the Sortify database. Nothing touches the disk until this is called"""
+    return connect(path)
+
+def connect(path, timeout=30.0, check_same_thread=True):
+    """Open sortify.db in WAL mode so readers never block the writer and bring the schema up to date"""
+    db = sqlite3.connect(path, timeout=timeout, check_same_thread=check_same_thread)
+    # wait for other app instances instead of failing straight away with "database is locked"
+    db.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+    db.execute("PRAGMA journal_mode = WAL")
+    # with WAL, NORMAL only syncs at checkpoints, a commit no longer costs an fsync
+    db.execute("PRAGMA synchronous = NORMAL")
+    migrate(db)
+    return db
+
+
+# ---- MIGRATIONS ----
+
+# each entry brings the schema from version - 1 to version, PRAGMA user_version records
+# how far a database has got. Never edit a shipped migration, append a new one instead.
+MIGRATIONS = [
+    (1, [
+        # baseline schema, IF NOT EXISTS so databases made before migrations existed pass through
+        #credential table
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+        """,
+        #history table
+        """
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            category TEXT,
+            item TEXT
+        )
+        """,
+        #feedback history table
+        """
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            type TEXT NOT NULL,
+            message TEXT
+        )
+        """,
+        # Eco points table for gamification
+        """
+        CREATE TABLE IF NOT EXISTS eco_points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            points INTEGER DEFAULT 0,
+            FOREIGN KEY (username) REFERENCES users (username)
+        )
+        """,
+        # Classification cache, keyed on image content hash + normalized description
+        """
+        CREATE TABLE IF NOT EXISTS classification_cache (
+            key TEXT PRIMARY KEY,
+            probabilities TEXT NOT NULL,
+            category TEXT NOT NULL,
+            last_used REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_classification_cache_last_used ON classification_cache (last_used)",
+    ]),
+    (2, [
+        # when each row was written (unix seconds), rows from before this migration stay NULL
+        "ALTER TABLE history ADD COLUMN created_at REAL",
+        "ALTER TABLE feedback ADD COLUMN created_at REAL",
+        "CREATE INDEX idx_history_username_created ON history (username, created_at)",
+        "CREATE INDEX idx_history_created ON history (created_at)",
+        "CREATE INDEX idx_feedback_username_created ON feedback (username, created_at)",
+        "CREATE INDEX idx_feedback_created ON feedback (created_at)",
+    ]),
+    (3, [
+        # per-user counts kept up to date by triggers, so admin lookups never scan history/feedback.
+        # kind is 'history' (category = classification result) or 'feedback' (category = Correct/Incorrect)
+        """
+        CREATE TABLE user_stats (
+            username TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            category TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (username, kind, category)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO user_stats (username, kind, category, count)
+        SELECT username, 'history', COALESCE(category, ''), COUNT(*) FROM history GROUP BY username, COALESCE(category, '')
+        """,
+        """
+        INSERT INTO user_stats (username, kind, category, count)
+        SELECT username, 'feedback', type, COUNT(*) FROM feedback GROUP BY username, type
+        """,
+        """
+        CREATE TRIGGER history_stats_insert AFTER INSERT ON history BEGIN
+            INSERT INTO user_stats (username, kind, category, count) VALUES (new.username, 'history', COALESCE(new.category, ''), 1)
+            ON CONFLICT (username, kind, category) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER history_stats_delete AFTER DELETE ON history BEGIN
+            UPDATE user_stats SET count = count - 1
+            WHERE username = old.username AND kind = 'history' AND category = COALESCE(old.category, '');
+        END
+        """,
+        """
+        CREATE TRIGGER history_stats_update AFTER UPDATE OF username, category ON history BEGIN
+            UPDATE user_stats SET count = count - 1
+            WHERE username = old.username AND kind = 'history' AND category = COALESCE(old.category, '');
+            INSERT INTO user_stats (username, kind, category, count) VALUES (new.username, 'history', COALESCE(new.category, ''), 1)
+            ON CONFLICT (username, kind, category) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER feedback_stats_insert AFTER INSERT ON feedback BEGIN
+            INSERT INTO user_stats (username, kind, category, count) VALUES (new.username, 'feedback', new.type, 1)
+            ON CONFLICT (username, kind, category) DO UPDATE SET count = count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER feedback_stats_delete AFTER DELETE ON feedback BEGIN
+            UPDATE user_stats SET count = count - 1
+            WHERE username = old.username AND kind = 'feedback' AND category = old.type;
+        END
+        """,
+        """
+        CREATE TRIGGER feedback_stats_update AFTER UPDATE OF username, type ON feedback BEGIN
+            UPDATE user_stats SET count = count - 1
+            WHERE username = old.username AND kind = 'feedback' AND category = old.type;
+            INSERT INTO user_stats (username, kind, category, count) VALUES (new.username, 'feedback', new.type, 1)
+            ON CONFLICT (username, kind, category) DO UPDATE SET count = count + 1;
+        END
+        """,
+    ]),
+    (4, [
+        # index entries are ordered by (username, rowid), which is exactly the keyset used to page
+        # through one user's feedback
+        "CREATE INDEX idx_feedback_username ON feedback (username)",
+    ]),
+    (5, [
+        # files the watched-folder ingest has already written to history, with the size and mtime
+        # they had at the time so a replaced file is picked up again
+        """
+        CREATE TABLE ingest_checkpoint (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            history_id INTEGER,
+            processed_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (6, [
+        # which classification a piece of feedback is about and the category the user was shown,
+        # so Correct/Incorrect can serve as labels when tuning the scoring rules
+        "ALTER TABLE feedback ADD COLUMN history_id INTEGER",
+        "ALTER TABLE feedback ADD COLUMN judged_category TEXT",
+        "CREATE INDEX idx_feedback_history ON feedback (history_id)",
+    ]),
+    (7, [
+        # covers the date-range reports in reporting.py: a month's rows are one range of this index and
+        # the table itself is never read. Replaces the plain created_at index, which is a prefix of it
+        "CREATE INDEX idx_history_created_user_category ON history (created_at, username, category)",
+        "DROP INDEX idx_history_created",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(db):
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(db):
+    """Apply any migrations this database hasn't seen yet, each one in its own transaction"""
+    for version, statements in MIGRATIONS:
+        if schema_version(db) >= version:
+            continue
+        # IMMEDIATE takes the write lock up front, then re-check in case another instance
+        # migrated while we were waiting for it
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(db) < version:
+                for statement in statements:
+                    db.execute(statement)
+                db.execute(f"PRAGMA user_version = {version}")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+
+# ---- USER STATS ----
+
+def user_stats(db, username, kind):
+    """{category: count} for one user, read from the trigger-maintained summary table"""
+    rows = db.execute("SELECT category, count FROM user_stats WHERE username=? AND kind=? AND count > 0",
+                      (username, kind)).fetchall()
+    return dict(rows)
+
+
+# ---- PAGED QUERIES ----
+
+def _prefix_upper_bound(prefix):
+    # smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def users_page(db, after=None, prefix="", limit=100):
+    """Next page of usernames in order, starting after the username `after` (keyset pagination).
+
+    A prefix turns into a range on the unique username index, so searching never scans the table.
+    """
+    clauses, params = [], []
+    if after is not None:
+        clauses.append("username > ?")
+        params.append(after)
+    if prefix:
+        clauses.append("username >= ? AND username < ?")
+        params += [prefix, _prefix_upper_bound(prefix)]
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = db.execute(f"SELECT username FROM users {where} ORDER BY username LIMIT ?", params + [limit]).fetchall()
+    return [(row[0], row[0]) for row in rows]
+
+def feedback_page(db, username, after=None, limit=100):
+    """Next page of (id, (type, message)) for one user, oldest first, starting after feedback id `after`"""
+    rows = db.execute("SELECT id, type, message FROM feedback WHERE username=? AND id > ? ORDER BY id LIMIT ?",
+                      (username, after or 0, limit)).fetchall()
+    return [(row[0], (row[1], row[2])) for row in rows]
+
+
+# ---- ECO POINTS ----
+
+def get_user_points(db, username):
+    result = db.execute("SELECT points FROM eco_points WHERE username=?", (username,)).fetchone()
+    return result[0] if result else 0
+
+def add_points(db, username, points):
+    # one statement instead of SELECT + UPDATE/INSERT + SELECT, and no window for two
+    # app instances to both read the old total
+    total = db.execute("""
+        INSERT INTO eco_points (username, points) VALUES (?, ?)
+        ON CONFLICT (username) DO UPDATE SET points = points + excluded.points
+        RETURNING points
+    """, (username, points)).fetchone()[0]
+    db.commit()
+    return total
+
+
+# ---- INGEST CHECKPOINT ----
+
+def ingest_checkpoint(db):
+    """{path: (size, mtime)} for every file the folder ingest has already recorded"""
+    return {path: (size, mtime) for path, size, mtime in db.execute("SELECT path, size, mtime FROM ingest_checkpoint")}
+
+def record_ingested(db, rows):
+    """Write history rows and their checkpoints in one transaction, rows are (username, category, item, path, size, mtime).
+
+    A crash either keeps both or neither, so a restarted ingest never skips or double-counts a file.
+    Returns the new history row ids in order.
+    """
+    now = time.time()
+    history_ids = []
+    with db:
+        for username, category, item, path, size, mtime in rows:
+            history_id = db.execute(HISTORY_INSERT, (username, category, item, now)).lastrowid
+            history_ids.append(history_id)
+            db.execute("""
+                INSERT INTO ingest_checkpoint (path, size, mtime, history_id, processed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime,
+                    history_id = excluded.history_id, processed_at = excluded.processed_at
+            """, (path, size, mtime, history_id, now))
+    return history_ids
+
+
+# ---- WRITE-BEHIND QUEUE ----
+
+HISTORY_INSERT = "INSERT INTO history (username, category, item, created_at) VALUES (?, ?, ?, ?)"
+FEEDBACK_INSERT = "INSERT INTO feedback (username, type, message, created_at) VALUES (?, ?, ?, ?)"
+# resolved when the row is written, after any history rows queued before it, so it finds the
+# classification the user just saw
+FEEDBACK_ON_LAST_HISTORY_INSERT = """
+    INSERT INTO feedback (username, type, message, created_at, history_id, judged_category)
+    SELECT ?, ?, ?, ?, last.id, last.category
+    FROM (SELECT NULL) LEFT JOIN (
+        SELECT id, category FROM history WHERE username = ? ORDER BY created_at DESC, id DESC LIMIT 1
+    ) AS last
+"""
+
+
+class WriteBehindWriter:
+    """Queues history/feedback inserts and writes them from one thread in batched transactions.
+
+    Rows are committed when max_batch rows are waiting or flush_interval seconds have passed
+    since the first one, whichever comes first, so a burst of classifications costs one commit.
+    Call flush() when a caller needs its rows to be visible, and close() before exiting.
+
+    With a feature_store, history rows inserted with features also get a feature record keyed to
+    their new row id once the transaction has committed.
+    """
+
+    def __init__(self, path, max_batch=500, flush_interval=0.5, timeout=30.0, feature_store=None):
+        self.path = path
+        self.feature_store = feature_store
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.pending = queue.Queue()
+        self.stats = {"rows": 0, "commits": 0, "retries": 0, "dropped": 0}
+        self._thread = threading.Thread(target=self._run, name="sortify-writer", daemon=True)
+        self._thread.start()
+
+    def insert_history(self, username, category, item, features=None, description=""):
+        extra = (features, description) if features is not None and self.feature_store is not None else None
+        self.pending.put((HISTORY_INSERT, (username, category, item, time.time()), extra))
+
+    def insert_feedback(self, username, feedback_type, message, about_last_history=False):
+        # about_last_history links the feedback to the user's latest classification
+        if about_last_history:
+            self.pending.put((FEEDBACK_ON_LAST_HISTORY_INSERT, (username, feedback_type, message, time.time(), username), None))
+        else:
+            self.pending.put((FEEDBACK_INSERT, (username, feedback_type, message, time.time()), None))
+
+    def flush(self, timeout=None):
+        # blocks until everything queued before this call has been committed
+        done = threading.Event()
+        self.pending.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self.pending.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        # opened with the first batch and again after a failed open, so an unreachable share or a
+        # migration stuck behind another instance costs the rows of that batch, not the thread
+        db = None
+        stopping = False
+        while not stopping:
+            item = self.pending.get()
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.flush_interval
+
+            # gather everything that arrives before the deadline, up to max_batch rows
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or waiters or len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    if db is None:
+                        db = connect(self.path, self.timeout)
+                    self._commit(db, batch)
+            except Exception as e:
+                # the writer thread must outlive any one batch, or every later row would be lost
+                print("Database Error:", e)
+                self.stats["dropped"] += len(batch)
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+        if db is not None:
+            db.close()
+
+    def _commit(self, db, batch):
+        for attempt in range(5):
+            stored = []
+            try:
+                with db:
+                    for sql, params, extra in batch:
+                        row_id = db.execute(sql, params).lastrowid
+                        if extra is not None:
+                            stored.append((row_id, *extra))
+            except sqlite3.Error as e:
+                locked = isinstance(e, sqlite3.OperationalError) and "locked" in str(e)
+                if locked and attempt < 4:
+                    # busy_timeout covers most contention, back off a little more if another
+                    # instance on the shared drive is holding the lock for longer
+                    self.stats["retries"] += 1
+                    time.sleep(0.1 * 2 ** attempt)
+                    continue
+                if locked or len(batch) == 1:
+                    print("Database Error:", e)
+                    self.stats["dropped"] += len(batch)
+                    return
+                # one bad row (a constraint, a NULL username) must not take the rest of the batch
+                # with it, write them one at a time so only that row is dropped
+                for row in batch:
+                    self._commit(db, [row])
+                return
+            else:
+                self.stats["rows"] += len(batch)
+                self.stats["commits"] += 1
+                if stored:
+                    self._store_features(stored)
+                return
+
+    def _store_features(self, rows):
+        try:
+            self.feature_store.append(rows)
+        except Exception as e:
+            # the history rows are already committed, they just won't be rescorable
+            print("Feature Store Error:", e)
@@ -0,0 +1,161 @@
+"""Opt-in per-stage timings for classify_with_opencv.
+
+Nothing is recorded unless classifier.enable_profiling() has been called. While it is off the classifier
+only pays for a few `if timer:` checks per image.
+"""
+import json
+import threading
+import time
+
+# values are bucketed on a log scale with 4 buckets per power of two (HdrHistogram-style), so a
+# percentile read from the buckets is within 25% of the true value and a histogram is a fixed-size
+# list whatever the traffic. 96 buckets reach 2**25, about 33 seconds in microseconds.
+HISTOGRAM_BUCKETS = 96
+
+
+def bucket_index(value):
+    if value < 4:
+        return value
+    bits = value.bit_length()
+    # the 2 bits below the leading one pick the sub-bucket
+    return (bits - 2) * 4 + ((value >> (bits - 3)) & 3)
+
+def bucket_upper(index):
+    # smallest value that no longer falls in bucket index
+    if index < 4:
+        return index + 1
+    octave, sub = divmod(index, 4)
+    return (sub + 5) << (octave - 1)
+
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.counts = [0] * buckets
+        self.total = 0
+        self.count = 0
+        self.max = 0
+
+    def add(self, value):
+        value = int(value)
+        self.counts[min(bucket_index(value), len(self.counts) - 1)] += 1
+        self.total += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        # upper edge of the bucket the q-th value falls in, never more than the largest value seen
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return min(bucket_upper(i), self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {f"<{bucket_upper(i)}": n for i, n in enumerate(self.counts) if n},
+        }
+
+
+class StageTimer:
+    """Timings for one classification, handed down through load_image/extract_features/score_features"""
+
+    __slots__ = ("profiler", "last", "start", "stages", "pixels", "outcome", "error")
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.start = self.last = time.perf_counter()
+        self.stages = []
+        self.pixels = None
+        self.outcome = "ok"
+        self.error = None
+
+    def lap(self, stage):
+        # time since the previous lap is charged to stage
+        now = time.perf_counter()
+        self.stages.append((stage, now - self.last))
+        self.last = now
+
+    def note_image(self, shape):
+        # decoded size, after any reduced-resolution read but before the resize
+        self.pixels = shape[0] * shape[1]
+
+    def fallback(self, outcome, error=None):
+        # "unreadable" (imread returned nothing) or "error" (an exception), both answer 25/25/25/25
+        self.outcome = outcome
+        self.error = type(error).__name__ if error is not None else None
+
+    def finish(self):
+        self.profiler.record(self, time.perf_counter() - self.start)
+
+
+class Profiler:
+    """Per-stage duration histograms (microseconds) plus outcome counters, safe to share between threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.total = Histogram()
+            self.pixels = Histogram()
+            self.outcomes = {"ok": 0, "unreadable": 0, "error": 0}
+            self.errors = {}
+            self.started = time.time()
+
+    def start(self):
+        return StageTimer(self)
+
+    def record(self, timer, elapsed):
+        with self.lock:
+            for stage, seconds in timer.stages:
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram()
+                histogram.add(seconds * 1e6)
+            self.total.add(elapsed * 1e6)
+            if timer.pixels is not None:
+                self.pixels.add(timer.pixels)
+            self.outcomes[timer.outcome] += 1
+            if timer.error:
+                self.errors[timer.error] = self.errors.get(timer.error, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "since": self.started,
+                "classifications": self.total.count,
+                "outcomes": dict(self.outcomes),
+                "errors": dict(self.errors),
+                "total_us": self.total.snapshot(),
+                "stages_us": {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                "decoded_pixels": self.pixels.snapshot(),
+            }
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+
+def format_report(snapshot):
+    """Plain-text table of a Profiler.snapshot(), for the CLI and the admin dashboard"""
+    outcomes = snapshot["outcomes"]
+    lines = [f"{snapshot['classifications']} classifications, {outcomes['unreadable']} unreadable, "
+             f"{outcomes['error']} errors (both answered 25/25/25/25)"]
+    if snapshot["errors"]:
+        lines.append("errors: " + ", ".join(f"{name} x{n}" for name, n in snapshot["errors"].items()))
+    lines.append(f"{'stage':<14}{'count':>7}{'mean ms':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    rows = list(snapshot["stages_us"].items()) + [("total", snapshot["total_us"])]
+    for stage, h in rows:
+        lines.append(f"{stage:<14}{h['count']:>7}{h['mean'] / 1000:>10.3f}{h['p50'] / 1000:>9.3f}{h['p99'] / 1000:>9.3f}")
+    return "\n".join(lines)
@@ -0,0 +1,178 @@
+"""Region-level classification: python cli.py classify-regions <image> ...
+
+classify_with_opencv gives one verdict for the whole frame, so a mixed bin gets an averaged answer. Here
+the image is converted once, and summed-area tables (cv2.integral) are built over every colour mask, the
+white mask, the Canny edge map and the grey/value channels (sums and squared sums). Any rectangle's
+ratios and standard deviations are then four lookups per table, so a dense scan with hundreds of
+windows costs about one full-image pass, and all regions are scored together by the vectorized rules.
+
+Colour and white ratios match what extract_features would give on the cropped region exactly. Edges
+differ slightly along region borders, where Canny saw the neighbouring pixels instead of the crop edge.
+"""
+import cv2
+import numpy as np
+
+from classifier import (CATEGORIES, CLASSIFY_SIZE, COLOR_BITS, HSV_LUT, WHITE_THRESHOLD, ImageFeatures,
+                        keyword_hit_matrix, pick_read_flag, score_features_matrix)
+
+# the classifier's rules were written for 300x300 images, so by default the image is scaled until a
+# grid cell is about that size, which keeps texture and edge features on the scale the rules expect
+REGION_CELL_SIZE = CLASSIFY_SIZE
+MAX_WORK_SIDE = 2400
+
+# channels of the mask summed-area table, the colours in ImageFeatures order then white and edges
+MASK_CHANNELS = list(COLOR_BITS) + ["white", "edge"]
+
+
+def work_size(width, height, rows, cols, cell=REGION_CELL_SIZE, max_side=MAX_WORK_SIDE):
+    """(width, height) to analyse the image at: cells of about cell pixels, the aspect ratio kept"""
+    scale = min(cell * cols / width, cell * rows / height)
+    scale = min(scale, max_side / max(width, height))
+    return max(cols, round(width * scale)), max(rows, round(height * scale))
+
+def load_region_image(image_path, rows=4, cols=4):
+    """(image at the working size for a rows x cols grid, original (width, height)), None if unreadable"""
+    from PIL import Image
+
+    try:
+        with Image.open(image_path) as header:
+            width, height = header.size
+    except Exception:
+        return None
+    target_w, target_h = work_size(width, height, rows, cols)
+    # a reduced JPEG read only when it still leaves both sides at least the working size
+    img = cv2.imread(image_path, pick_read_flag(image_path, max(target_w, target_h)))
+    if img is None:
+        return None
+    return cv2.resize(img, (target_w, target_h)), (width, height)
+
+
+# ---- REGIONS ----
+
+def grid_boxes(width, height, rows, cols):
+    """(rows * cols, 4) array of (x0, y0, x1, y1) cells covering the image, row by row"""
+    xs = np.linspace(0, width, cols + 1).round().astype(np.int64)
+    ys = np.linspace(0, height, rows + 1).round().astype(np.int64)
+    x0, y0 = np.meshgrid(xs[:-1], ys[:-1])
+    x1, y1 = np.meshgrid(xs[1:], ys[1:])
+    return np.stack([x0.ravel(), y0.ravel(), x1.ravel(), y1.ravel()], axis=1)
+
+def sliding_boxes(width, height, size, stride):
+    """Every size x size window at the given stride, the last row and column pushed flush with the edge"""
+    def starts(extent):
+        last = max(extent - size, 0)
+        return np.unique(np.append(np.arange(0, last + 1, stride), last))
+    x0, y0 = np.meshgrid(starts(width), starts(height))
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + size, width), np.minimum(y0 + size, height)], axis=1)
+
+
+class RegionFeatures:
+    """Summed-area tables for one image, features(boxes) gives ImageFeatures for any set of rectangles"""
+
+    def __init__(self, img):
+        self.height, self.width = img.shape[:2]
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # same combined colour code as extract_features, one 0/255 mask per colour
+        h_bits, s_bits, v_bits = cv2.split(cv2.LUT(hsv, HSV_LUT))
+        code = cv2.bitwise_and(cv2.bitwise_and(h_bits, s_bits), v_bits)
+        masks = [cv2.compare(cv2.bitwise_and(code, bit), 0, cv2.CMP_NE) for bit in COLOR_BITS.values()]
+        masks.append(cv2.compare(gray, WHITE_THRESHOLD, cv2.CMP_GT))
+        masks.append(cv2.Canny(gray, 100, 200))
+        # one table per mask: cv2.integral runs faster on single channels than on one merged 8-channel
+        # image, and summing 255s leaves room in int32 up to 2 ** 31 / 255 pixels, more than MAX_WORK_SIDE squared
+        self.mask_sums = [cv2.integral(mask) for mask in masks]
+
+        # grey and value sums for the means, squared sums for the standard deviations
+        self.level_sums, self.level_squares = zip(*(cv2.integral2(channel, sdepth=cv2.CV_32S, sqdepth=cv2.CV_64F)
+                                                    for channel in (gray, hsv[:, :, 2])))
+
+    @staticmethod
+    def _box_sums(tables, boxes):
+        # sum over each box from its four corners, (R, len(tables))
+        x0, y0, x1, y1 = boxes.T
+        return np.stack([table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0] for table in tables],
+                        axis=1).astype(np.float64)
+
+    def features(self, boxes):
+        boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+        area = ((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])).astype(np.float64)[:, None]
+        if (area <= 0).any():
+            raise ValueError("every box needs x1 > x0 and y1 > y0")
+        counts = self._box_sums(self.mask_sums, boxes) / 255 / area
+        means = self._box_sums(self.level_sums, boxes) / area
+        squares = self._box_sums(self.level_squares, boxes) / area
+        # rounding can leave a tiny negative variance on a flat region
+        stds = np.sqrt(np.maximum(squares - means ** 2, 0.0))
+        ratios = dict(zip(MASK_CHANNELS, counts.T))
+        return ImageFeatures(
+            green_ratio=ratios["green"],
+            yellow_ratio=ratios["yellow"],
+            blue_ratio=ratios["blue"],
+            brown_ratio=ratios["brown"],
+            black_ratio=ratios["black"],
+            grey_ratio=ratios["grey"],
+            white_ratio=ratios["white"],
+            edge_ratio=ratios["edge"],
+            texture_variance=stds[:, 0],
+            brightness_std=stds[:, 1],
+        )
+
+    def classify(self, boxes, description=""):
+        """(R, 4) percentages in CATEGORIES order and the most likely category index for every box"""
+        return score_features_matrix(self.features(boxes), keyword_hit_matrix([description]))
+
+
+def classify_regions(image_path, rows=4, cols=4, description="", window=None, stride=None):
+    """Per-region categories for an image file.
+
+    Regions are a rows x cols grid, or with window set every window x window square (in working-size
+    pixels) at stride. Returns (boxes in original image pixels, percentages, category names), or None
+    when the image can't be read.
+    """
+    loaded = load_region_image(image_path, rows, cols)
+    if loaded is None:
+        return None
+    img, (original_w, original_h) = loaded
+    height, width = img.shape[:2]
+    if window:
+        boxes = sliding_boxes(width, height, window, stride or max(1, window // 2))
+    else:
+        boxes = grid_boxes(width, height, rows, cols)
+    percents, best = RegionFeatures(img).classify(boxes, description)
+    scale = np.array([original_w / width, original_h / height] * 2)
+    return (boxes * scale).round().astype(np.int64), percents, [CATEGORIES[i] for i in best]
+
+
+# ---- DRAWING ----
+
+# BGR fill per category for annotated images
+CATEGORY_COLOURS = {
+    "Recyclable": (200, 120, 0),
+    "Reusable": (160, 60, 180),
+    "Compostable": (40, 160, 40),
+    "Trash": (60, 60, 60),
+}
+
+def centre_cells(boxes, stride):
+    # the stride x stride square at each window's centre: together they tile the scanned area once
+    cx, cy = (boxes[:, 0] + boxes[:, 2]) // 2, (boxes[:, 1] + boxes[:, 3]) // 2
+    half = max(1, stride // 2)
+    return np.stack([cx - half, cy - half, cx + half, cy + half], axis=1)
+
+def draw_regions(img, boxes, categories, percents, alpha=0.35, labels=True):
+    """img with every box tinted in its category's colour, and labelled when labels is set"""
+    overlay = img.copy()
+    for (x0, y0, x1, y1), category in zip(boxes, categories):
+        cv2.rectangle(overlay, (int(x0), int(y0)), (int(x1) - 1, int(y1) - 1), CATEGORY_COLOURS[category], -1)
+    out = cv2.addWeighted(overlay, alpha, img, 1 - alpha, 0)
+    if labels:
+        scale = max(0.4, min(out.shape[:2]) / 1000)
+        for (x0, y0, x1, y1), category, row in zip(boxes, categories, percents):
+            cv2.rectangle(out, (int(x0), int(y0)), (int(x1) - 1, int(y1) - 1), CATEGORY_COLOURS[category], 2)
+            text = f"{category} {int(max(row))}%"
+            cv2.putText(out, text, (int(x0) + 6, int(y0) + int(24 * scale)), cv2.FONT_HERSHEY_SIMPLEX, scale,
+                        (255, 255, 255), max(1, int(2 * scale)), cv2.LINE_AA)
+    return out
@@ -0,0 +1,141 @@
+"""Streaming exports and SQL-side reports over the Sortify database.
+
+    python cli.py export history --format csv --output history.csv --since 2026-09-01 --until 2026-10-01
+    python cli.py report categories --since 2026-09-01
+
+Rows are pulled from SQLite in fetchmany() chunks and written out straight away, and every report is
+a GROUP BY that SQLite computes, so memory stays flat however many rows the tables hold.
+"""
+import csv
+import json
+import time
+
+# rows pulled per fetchmany() call
+CHUNK_ROWS = 5000
+
+# created_at is unix seconds, exports add a readable local time next to it
+EXPORTS = {
+    "history": ("SELECT id, username, category, item, created_at, "
+                "datetime(created_at, 'unixepoch', 'localtime') AS created FROM history", "created_at"),
+    "feedback": ("SELECT id, username, type, message, history_id, judged_category, created_at, "
+                 "datetime(created_at, 'unixepoch', 'localtime') AS created FROM feedback", "created_at"),
+    # eco_points holds running totals, there is nothing to filter by date
+    "eco_points": ("SELECT username, points FROM eco_points", None),
+}
+
+REPORTS = {
+    # classifications per user, day and category
+    "categories": """
+        SELECT username, date(created_at, 'unixepoch', 'localtime') AS day, COALESCE(category, '') AS category,
+               COUNT(*) AS items
+        FROM history {where}
+        GROUP BY username, day, category
+        ORDER BY username, day, category
+    """,
+    # classifications per day and category, all users together
+    "daily": """
+        SELECT date(created_at, 'unixepoch', 'localtime') AS day, COALESCE(category, '') AS category,
+               COUNT(*) AS items, COUNT(DISTINCT username) AS users
+        FROM history {where}
+        GROUP BY day, category
+        ORDER BY day, category
+    """,
+    # how often users said the category they were shown was wrong, only feedback linked to a classification
+    "feedback": """
+        SELECT judged_category AS category, COUNT(*) AS feedback,
+               SUM(type = 'Incorrect') AS incorrect, ROUND(AVG(type = 'Incorrect'), 4) AS incorrect_rate
+        FROM feedback {where}
+        GROUP BY judged_category
+        ORDER BY incorrect_rate DESC
+    """,
+}
+
+# extra WHERE conditions per report, on top of the date range
+REPORT_FILTERS = {"feedback": ["judged_category IS NOT NULL"]}
+
+
+def day_start(text):
+    """Unix seconds at local midnight of a YYYY-MM-DD date"""
+    return time.mktime(time.strptime(text, "%Y-%m-%d"))
+
+def _date_range(column, since=None, until=None):
+    # since is inclusive and until exclusive, so months chain: --since 2026-09-01 --until 2026-10-01
+    clauses, params = [], []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(day_start(since))
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(day_start(until))
+    return clauses, params
+
+def _where(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+def iter_query(db, sql, params=(), chunk_rows=CHUNK_ROWS):
+    """(columns, chunks): the column names and a generator of row lists of at most chunk_rows rows"""
+    cursor = db.execute(sql, params)
+    columns = [d[0] for d in cursor.description]
+
+    def chunks():
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield rows
+    return columns, chunks()
+
+def export_query(table, since=None, until=None):
+    sql, date_column = EXPORTS[table]
+    if (since or until) and date_column is None:
+        raise ValueError(f"{table} has no dates to filter by")
+    clauses, params = _date_range(date_column, since, until)
+    # id order is insertion order, and lets the scan follow the table's primary key
+    order = " ORDER BY id" if table != "eco_points" else " ORDER BY username"
+    return sql + " " + _where(clauses) + order, params
+
+def report_query(report, since=None, until=None):
+    clauses, params = _date_range("created_at", since, until)
+    return REPORTS[report].format(where=_where(REPORT_FILTERS.get(report, []) + clauses)), params
+
+
+# ---- WRITERS ----
+
+def write_rows(columns, chunks, out, fmt="csv"):
+    """Write chunks of rows to the text file out as csv, jsonl or an aligned table, returns the row count"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    elif fmt == "jsonl":
+        for rows in chunks:
+            out.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+    elif fmt == "table":
+        # column widths from the header only, so the table can be printed before all rows are read
+        widths = [max(len(c), 12) for c in columns]
+        out.write("  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip() + "\n")
+        for rows in chunks:
+            out.writelines("  ".join(("" if v is None else str(v)).ljust(w) for v, w in zip(row, widths)).rstrip() + "\n"
+                           for row in rows)
+            count += len(rows)
+    else:
+        raise ValueError(f"unknown format {fmt}")
+    return count
+
+def export_table(db, table, out, fmt="csv", since=None, until=None, chunk_rows=CHUNK_ROWS):
+    """Stream one of EXPORTS to out, returns how many rows were written"""
+    sql, params = export_query(table, since, until)
+    columns, chunks = iter_query(db, sql, params, chunk_rows)
+    return write_rows(columns, chunks, out, fmt)
+
+def write_report(db, report, out, fmt="table", since=None, until=None, chunk_rows=CHUNK_ROWS):
+    """Write one of REPORTS to out, returns how many rows were written"""
+    # per user per day can still be a lot of rows, so the result streams like an export
+    sql, params = report_query(report, since, until)
+    columns, chunks = iter_query(db, sql, params, chunk_rows)
+    return write_rows(columns, chunks, out, fmt)
@@ -0,0 +1,246 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import classifier
+import persistence
+from feature_store import FeatureStore, default_path as feature_store_path
+
+MAX_UPLOAD_BYTES = 64 * 1024 * 1024
+
+
+class UnreadableImage(ValueError):
+    """The uploaded bytes aren't an image the classifier can decode"""
+
+
+def _classify_payloads(batch):
+    # one micro-batch of uploads, in a pool process
+    images, descriptions = [], []
+    for data, description in batch:
+        try:
+            images.append(classifier.decode_image_bytes(data))
+        except Exception as e:
+            print("OpenCV Error:", e)
+            images.append(None)
+        descriptions.append(description)
+    # features stay None for anything that couldn't be decoded or classified, which flags it to _finish
+    features = []
+    results = classifier.classify_images(images, descriptions, features)
+    return list(zip(results, features))
+
+
+class MicroBatcher:
+    """Collects concurrent requests into micro-batches and runs them on a bounded process pool.
+
+    submit() never blocks: when queue_size requests are already waiting it raises queue.Full and the
+    HTTP layer answers 429. A dispatcher thread takes up to max_batch requests, waiting at most
+    max_wait seconds for a batch to fill, and keeps at most 2 batches per worker in flight.
+    """
+
+    def __init__(self, writer, workers=None, queue_size=256, max_batch=16, max_wait=0.01):
+        self.writer = writer
+        self.workers = workers or os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=classifier.init_worker,
+                                        initargs=classifier.worker_initargs())
+        self.in_flight = threading.BoundedSemaphore(self.workers * 2)
+        # counters are bumped from request threads, the dispatcher and pool callbacks
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rejected": 0, "batches": 0, "errors": 0}
+        self._stopping = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="sortify-batcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, data, description, username):
+        future = Future()
+        with self.lock:
+            # checked under the lock so nothing slips into the queue after close() has drained it
+            if self._stopping:
+                future.set_exception(RuntimeError("server is shutting down"))
+                return future
+            try:
+                self.pending.put_nowait((data, description, username, future))
+            except queue.Full:
+                self.stats["rejected"] += 1
+                raise
+            self.stats["requests"] += 1
+        return future
+
+    def close(self):
+        with self.lock:
+            self._stopping = True
+        self.pending.put(None)
+        self._dispatcher.join()
+        # requests the dispatcher never picked up would otherwise wait out their whole timeout
+        while True:
+            try:
+                item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[3].set_exception(RuntimeError("server is shutting down"))
+        self.pool.shutdown()
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def _dispatch(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._stopping = True
+                    break
+                batch.append(item)
+
+            # waiting here is the backpressure: the queue fills up and new requests get 429s
+            self.in_flight.acquire()
+            job = self.pool.submit(_classify_payloads, [(data, description) for data, description, _, _ in batch])
+            job.add_done_callback(lambda done, batch=batch: self._finish(batch, done))
+            self._count("batches")
+            if self._stopping:
+                return
+
+    def _finish(self, batch, done):
+        self.in_flight.release()
+        try:
+            results = done.result()
+        except Exception as e:
+            self._count("errors")
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (data, description, username, future), ((probabilities, most_likely), features) in zip(batch, results):
+            if features is None:
+                # the 25/25/25/25 fallback says nothing about the upload, the client gets an error instead
+                future.set_exception(UnreadableImage("request body is not a readable image"))
+                continue
+            item_name = f"upload ({description})" if description else "upload"
+            self.writer.insert_history(username, most_likely, item_name, features=features, description=description)
+            future.set_result((probabilities, most_likely))
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        return dict(stats, queued=self.pending.qsize(), workers=self.workers)
+
+
+class ClassifyHandler(BaseHTTPRequestHandler):
+    # POST /classify?description=...&user=...   body: the encoded image
+    # GET  /health                             queue and batching counters
+    batcher = None
+    request_timeout = 30.0
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self._send_json(200, self.batcher.snapshot())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/classify":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._send_json(400, {"error": "request body must be the image bytes"})
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self._send_json(413, {"error": "image too large"})
+            return
+
+        params = parse_qs(url.query)
+        description = params.get("description", [""])[0]
+        username = params.get("user", ["service"])[0]
+        data = self.rfile.read(length)
+
+        try:
+            future = self.batcher.submit(data, description, username)
+        except queue.Full:
+            self._send_json(429, {"error": "classifier busy, retry shortly"}, {"Retry-After": "1"})
+            return
+
+        try:
+            probabilities, most_likely = future.result(timeout=self.request_timeout)
+        except UnreadableImage as e:
+            self._send_json(422, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {"probabilities": probabilities, "most_likely": most_likely})
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one line per request on stderr is too much under load
+        pass
+
+
+class ClassifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default listen backlog of 5 resets connections under a burst of uploads,
+    # let them queue up and be answered with a 429 instead
+    request_queue_size = 128
+
+
+def serve(host="127.0.0.1", port=8765, workers=None, queue_size=256, max_batch=16, max_wait=0.01, db_path=persistence.DEFAULT_DB_PATH):
+    """Run the classification service until interrupted"""
+    writer = persistence.WriteBehindWriter(db_path, feature_store=FeatureStore(feature_store_path(db_path)))
+    batcher = MicroBatcher(writer, workers, queue_size, max_batch, max_wait)
+    handler = type("Handler", (ClassifyHandler,), {"batcher": batcher})
+    httpd = ClassifyServer((host, port), handler)
+    print(f"Sortify classifier listening on http://{host}:{port} ({batcher.workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        batcher.close()
+        writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="sortify-server", description="Sortify HTTP classification service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="classifier processes (default: cpu count)")
+    parser.add_argument("--queue-size", type=int, default=256, help="waiting requests before answering 429")
+    parser.add_argument("--max-batch", type=int, default=16, help="requests per micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="how long a batch waits to fill up")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, args.queue_size, args.max_batch, args.max_wait_ms / 1000)
@@ -0,0 +1,362 @@
+"""Regression tests for the headless modules: python -m unittest"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+import classifier
+import persistence
+from ingest import IngestPipeline
+from bench import CORPUS_PROFILES, synthetic_image
+from classifier import ImageFeatures, classify_batch, classify_with_opencv
+from feature_store import FeatureStore, features_of, keyword_hits_of
+
+
+class ClassifyBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(7)
+        self.paths = []
+        sizes = [(320, 240), (640, 480), (1200, 900), (300, 300)]
+        for i, (profile, size) in enumerate(zip(list(CORPUS_PROFILES) * 2, sizes * 2)):
+            # jpg goes through the reduced decode, png through a full one
+            path = os.path.join(self.tmp.name, f"{i}_{profile}.{'jpg' if i % 2 else 'png'}")
+            cv2.imwrite(path, synthetic_image(rng, profile, size))
+            self.paths.append(path)
+        unreadable = os.path.join(self.tmp.name, "broken.jpg")
+        with open(unreadable, "wb") as f:
+            f.write(b"not an image")
+        self.paths.append(unreadable)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_matches_scalar(self):
+        for description in ["", "banana peel", "plastic bottle", "old glass jar and a can", "zzz"]:
+            with self.subTest(description=description):
+                self.assertEqual(classify_batch(self.paths, description),
+                                 [classify_with_opencv(path, description) for path in self.paths])
+
+    def test_per_image_descriptions(self):
+        descriptions = [["", "banana peel", "plastic bottle"][i % 3] for i in range(len(self.paths))]
+        self.assertEqual(classify_batch(self.paths, descriptions),
+                         [classify_with_opencv(p, d) for p, d in zip(self.paths, descriptions)])
+
+    def test_unreadable_is_fallback(self):
+        self.assertEqual(classify_batch(self.paths[-1:], ""), [classifier.FALLBACK_RESULT])
+
+
+class KeywordMatcherTest(unittest.TestCase):
+    def test_whole_words_and_plurals(self):
+        hits = classifier.keyword_matcher.hits
+        for description, expected in [("can", {"Recyclable"}), ("cans", {"Recyclable"}), ("scan", set()),
+                                      ("canes", set()), ("pecan", set()), ("two boxes", {"Reusable"}),
+                                      ("wine glasses", {"Recyclable"}), ("jars", {"Reusable"}),
+                                      ("BANANA peel", {"Compostable"}), ("boxer", set())]:
+            with self.subTest(description=description):
+                self.assertEqual(hits(description), expected)
+
+    def test_multi_word_keywords(self):
+        hits = classifier.keyword_matcher.hits
+        self.assertEqual(hits("chair in good condition"), {"Reusable"})
+        self.assertEqual(hits("good   Condition"), {"Reusable"})
+        self.assertEqual(hits("good conditioner"), set())
+        self.assertEqual(hits("good"), set())
+
+    def test_custom_vocabulary(self):
+        matcher = classifier.KeywordMatcher({"Compostable": ["berry", "coffee grounds"], "Trash": ["Chip Bag"]})
+        self.assertEqual(matcher.hits("berries and old coffee grounds"), {"Compostable"})
+        self.assertEqual(matcher.hits("two chip bags"), {"Trash"})
+        self.assertEqual(matcher.hits("bagged chips"), set())
+
+
+def memory_db():
+    db = sqlite3.connect(":memory:")
+    persistence.migrate(db)
+    return db
+
+
+class WriteBehindWriterTest(unittest.TestCase):
+    def test_bad_row_only_drops_itself(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sortify.db")
+            with persistence.WriteBehindWriter(path) as writer:
+                writer.insert_history("ann", "Trash", "a")
+                writer.insert_history(None, "Trash", "no user")
+                writer.insert_history("ann", "Reusable", "b")
+                self.assertTrue(writer.flush(timeout=10))
+                writer.insert_history("ann", "Trash", "c")
+                self.assertTrue(writer.flush(timeout=10))
+                self.assertEqual((writer.stats["rows"], writer.stats["dropped"]), (3, 1))
+            db = persistence.connect(path)
+            self.assertEqual([row[0] for row in db.execute("SELECT item FROM history ORDER BY id")], ["a", "b", "c"])
+            db.close()
+
+    def test_unopenable_database_drains_the_queue(self):
+        writer = persistence.WriteBehindWriter(os.path.join(tempfile.gettempdir(), "no such dir", "sortify.db"))
+        writer.insert_history("ann", "Trash", "a")
+        writer.insert_history("ann", "Trash", "b")
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(writer.stats["dropped"], 2)
+        writer.close()
+
+
+class ClassificationCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.db = memory_db()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_memory_then_disk_hits(self):
+        cache = classifier.ClassificationCache(self.db)
+        cache.put("k", {"Trash": 100}, "Trash")
+        self.assertEqual(cache.get("k"), ({"Trash": 100}, "Trash"))
+        # a new cache on the same database starts with an empty memory tier
+        cache = classifier.ClassificationCache(self.db)
+        self.assertEqual(cache.get("k"), ({"Trash": 100}, "Trash"))
+        self.assertEqual(cache.get("k"), ({"Trash": 100}, "Trash"))
+        self.assertIsNone(cache.get("other"))
+        self.assertEqual(cache.stats, {"memory_hits": 1, "disk_hits": 1, "misses": 1, "evictions": 0})
+
+    def test_memory_tier_is_lru(self):
+        cache = classifier.ClassificationCache(self.db, memory_size=2)
+        cache.put("a", {}, "Trash")
+        cache.put("b", {}, "Trash")
+        cache.get("a")
+        cache.put("c", {}, "Trash")
+        self.assertEqual(list(cache.memory), ["a", "c"])
+
+    def test_disk_eviction_drops_least_recently_used(self):
+        clock = iter(range(1, 1000))
+        with mock.patch.object(classifier.time, "time", lambda: next(clock)):
+            cache = classifier.ClassificationCache(self.db, memory_size=1, disk_size=10)
+            for i in range(10):
+                cache.put(f"k{i}", {}, "Trash")
+            # reading k0 from disk makes it the most recently used row
+            cache.get("k0")
+            cache.put("k10", {}, "Trash")
+        kept = {row[0] for row in self.db.execute("SELECT key FROM classification_cache")}
+        self.assertEqual(kept, {"k0"} | {f"k{i}" for i in range(3, 11)})
+        self.assertEqual(cache.stats["evictions"], 2)
+
+    def test_classify_cached(self):
+        path = os.path.join(self.tmp.name, "item.png")
+        cv2.imwrite(path, synthetic_image(np.random.default_rng(1), "plastic", (320, 240)))
+        cache = classifier.ClassificationCache(self.db)
+        expected = classify_with_opencv(path, "plastic bottle")
+        self.assertEqual(classifier.classify_cached(path, "plastic bottle", cache), expected)
+        self.assertEqual(classifier.classify_cached(path, "plastic bottle", cache), expected)
+        self.assertEqual(classifier.classify_cached(classifier.ImageHandle(path), "plastic bottle", cache), expected)
+        self.assertEqual((cache.stats["misses"], cache.stats["memory_hits"]), (1, 2))
+
+    def test_fallback_is_not_cached(self):
+        path = os.path.join(self.tmp.name, "partial.jpg")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xd8 still copying")
+        cache = classifier.ClassificationCache(self.db)
+        for _ in range(2):
+            self.assertEqual(classifier.classify_cached(path, "", cache), classifier.FALLBACK_RESULT)
+        self.assertEqual(cache.snapshot()["disk_entries"], 0)
+        self.assertEqual(cache.stats["misses"], 2)
+
+
+class UserStatsTriggerTest(unittest.TestCase):
+    def test_counts_follow_inserts_updates_and_deletes(self):
+        db = memory_db()
+        rows = [("ann", "Trash"), ("ann", "Trash"), ("ann", "Compostable"), ("bob", "Recyclable"), ("ann", None)]
+        db.executemany("INSERT INTO history (username, category, item) VALUES (?, ?, 'x')", rows)
+        db.executemany("INSERT INTO feedback (username, type, message) VALUES (?, ?, '')",
+                       [("ann", "Correct"), ("ann", "Incorrect"), ("ann", "Correct")])
+        db.execute("UPDATE history SET category = 'Reusable' WHERE id = 1")
+        db.execute("UPDATE history SET username = 'bob' WHERE id = 3")
+        db.execute("DELETE FROM feedback WHERE id = 2")
+
+        for username in ("ann", "bob"):
+            expected = dict(db.execute("SELECT COALESCE(category, ''), COUNT(*) FROM history WHERE username = ? "
+                                       "GROUP BY COALESCE(category, '')", (username,)).fetchall())
+            self.assertEqual(persistence.user_stats(db, username, "history"), expected)
+        self.assertEqual(persistence.user_stats(db, "ann", "history"), {"Reusable": 1, "Trash": 1, "": 1})
+        self.assertEqual(persistence.user_stats(db, "ann", "feedback"), {"Correct": 2})
+        self.assertEqual(persistence.user_stats(db, "bob", "feedback"), {})
+
+
+class IngestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp.name, "scans")
+        os.makedirs(self.folder)
+        self.db_path = os.path.join(self.tmp.name, "sortify.db")
+        rng = np.random.default_rng(5)
+        for i, profile in enumerate(CORPUS_PROFILES):
+            cv2.imwrite(os.path.join(self.folder, f"{i}.jpg"), synthetic_image(rng, profile, (320, 240)))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def ingest(self):
+        pipeline = IngestPipeline(self.folder, db_path=self.db_path, settle=0, decode_workers=2, classify_workers=2)
+        return pipeline.run(once=True, report_interval=0)
+
+    def history(self):
+        db = persistence.connect(self.db_path)
+        try:
+            return sorted(db.execute("SELECT item, category FROM history").fetchall())
+        finally:
+            db.close()
+
+    def test_restart_skips_recorded_files(self):
+        self.assertEqual(self.ingest()["written"], len(CORPUS_PROFILES))
+        first = self.history()
+        self.assertEqual(self.ingest()["queued"], 0)
+        self.assertEqual(self.history(), first)
+
+        # a file replaced since it was recorded is picked up again
+        path = os.path.join(self.folder, "0.jpg")
+        cv2.imwrite(path, synthetic_image(np.random.default_rng(9), "plastic", (320, 240)))
+        os.utime(path, (1, 1))
+        self.assertEqual(self.ingest()["written"], 1)
+
+    def test_unreadable_file_is_retried(self):
+        path = os.path.join(self.folder, "partial.jpg")
+        with open(path, "wb") as f:
+            f.write(b"\xff\xd8 still copying")
+        snapshot = self.ingest()
+        self.assertEqual((snapshot["written"], snapshot["unreadable"]), (len(CORPUS_PROFILES), 1))
+        self.assertNotIn("partial.jpg", [item for item, _ in self.history()])
+
+        # once the copy has finished it goes through like any other file
+        cv2.imwrite(path, synthetic_image(np.random.default_rng(2), "organic", (320, 240)))
+        snapshot = self.ingest()
+        self.assertEqual((snapshot["queued"], snapshot["written"]), (1, 1))
+        self.assertIn("partial.jpg", [item for item, _ in self.history()])
+
+
+class KeysetPagingTest(unittest.TestCase):
+    def setUp(self):
+        self.db = memory_db()
+        self.names = [f"user{i:03d}" for i in range(250)] + ["zoe", "zed"]
+        self.db.executemany("INSERT INTO users (username, password) VALUES (?, 'pw')", [(n,) for n in self.names])
+
+    def pages(self, fetch, limit):
+        items, after = [], None
+        while True:
+            page = fetch(after, limit)
+            self.assertLessEqual(len(page), limit)
+            if not page:
+                return items
+            items += page
+            after = page[-1][0]
+
+    def test_users_pages_cover_every_user_once_in_order(self):
+        items = self.pages(lambda after, limit: persistence.users_page(self.db, after, limit=limit), 100)
+        self.assertEqual([key for key, _ in items], sorted(self.names))
+
+    def test_users_prefix(self):
+        items = self.pages(lambda after, limit: persistence.users_page(self.db, after, "user1", limit), 7)
+        self.assertEqual([key for key, _ in items], [n for n in sorted(self.names) if n.startswith("user1")])
+        self.assertEqual(persistence.users_page(self.db, prefix="z"), [("zed", "zed"), ("zoe", "zoe")])
+
+    def test_feedback_pages_only_one_user(self):
+        self.db.executemany("INSERT INTO feedback (username, type, message) VALUES (?, 'Correct', ?)",
+                            [("zoe" if i % 3 else "zed", str(i)) for i in range(100)])
+        items = self.pages(lambda after, limit: persistence.feedback_page(self.db, "zoe", after, limit), 9)
+        self.assertEqual([message for _, (_, message) in items], [str(i) for i in range(100) if i % 3])
+
+
+class FeatureStoreTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(3)
+        descriptions = ["", "banana peel", "plastic bottle", "glass jar", "broken cup"]
+        rows = [(i + 1, ImageFeatures(*rng.random(len(ImageFeatures._fields))), descriptions[i % len(descriptions)])
+                for i in range(40)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sortify.features")
+            store = FeatureStore(path)
+            store.append(rows[:25])
+            store.append(rows[25:])
+            # a torn record at the end is cut off when the store is opened again
+            with open(path, "ab") as f:
+                f.write(b"\0" * 5)
+            store = FeatureStore(path)
+            self.assertEqual(len(store), len(rows))
+
+            records = store.records()
+            self.assertEqual(records["history_id"].tolist(), [history_id for history_id, _, _ in rows])
+            stored = features_of(records)
+            for name in ImageFeatures._fields:
+                self.assertEqual(getattr(stored, name).tolist(), [getattr(f, name) for _, f, _ in rows])
+            np.testing.assert_array_equal(keyword_hits_of(records),
+                                          classifier.keyword_hit_matrix([d for _, _, d in rows]))
+            del records, stored
+
+
+def if_chain_scores(f):
+    # the hand-written rules IMAGE_RULES replaced, kept to check the data-driven version against
+    recyclable_score = reusable_score = compostable_score = trash_score = 0
+
+    if f.black_ratio > 0.1 or f.grey_ratio > 0.18:
+        trash_score += 50
+    elif (f.black_ratio > 0.07 and (f.green_ratio + f.yellow_ratio + f.brown_ratio) < 0.08):
+        trash_score += 40
+    if f.brightness_std > 60 and (f.black_ratio + f.grey_ratio) > 0.15:
+        trash_score += 25
+
+    if f.green_ratio > 0.12 or f.yellow_ratio > 0.12 or f.brown_ratio > 0.1:
+        compostable_score += 40
+    if 20 < f.texture_variance < 60:
+        compostable_score += 20
+    if compostable_score > trash_score:
+        trash_score = max(0, trash_score - 20)
+
+    if f.blue_ratio > 0.08:
+        recyclable_score += 35
+    if f.white_ratio > 0.15 and f.texture_variance < 55:
+        recyclable_score += 30
+    if f.edge_ratio > 0.18 and f.texture_variance < 65:
+        recyclable_score += 20
+
+    if f.edge_ratio > 0.25 and f.texture_variance < 40 and f.black_ratio < 0.08:
+        reusable_score += 35
+    if f.white_ratio > 0.2 and f.texture_variance < 35:
+        reusable_score += 25
+    if f.brown_ratio > 0.08 and f.texture_variance < 45:
+        reusable_score += 15
+
+    return {"Recyclable": recyclable_score, "Reusable": reusable_score,
+            "Compostable": compostable_score, "Trash": trash_score}
+
+
+class ScoringRulesTest(unittest.TestCase):
+    def setUp(self):
+        # values either side of and exactly on every threshold, plus random ones
+        rng = np.random.default_rng(11)
+        ratios = np.array([0.0, 0.03, 0.05, 0.07, 0.08, 0.1, 0.12, 0.15, 0.18, 0.2, 0.25, 0.3])
+        levels = np.array([0.0, 20.0, 35.0, 40.0, 45.0, 55.0, 60.0, 65.0, 80.0])
+        count = 5000
+        columns = [np.where(rng.random(count) < 0.5, rng.choice(ratios, count), rng.random(count) * 0.35)
+                   for _ in range(8)]
+        columns += [np.where(rng.random(count) < 0.5, rng.choice(levels, count), rng.random(count) * 90)
+                    for _ in range(2)]
+        self.features = ImageFeatures(*columns)
+        self.rules = classifier.ScoringRules(classifier.IMAGE_RULES, classifier.SCORE_ADJUSTMENTS)
+
+    def test_rules_match_if_chain(self):
+        for i in range(len(self.features.green_ratio)):
+            f = ImageFeatures(*(float(column[i]) for column in self.features))
+            self.assertEqual(self.rules.image_scores(f), if_chain_scores(f), f)
+
+    def test_batch_matches_scalar(self):
+        batch = self.rules.image_scores_batch(self.features)
+        for i in range(0, len(self.features.green_ratio), 50):
+            f = ImageFeatures(*(float(column[i]) for column in self.features))
+            self.assertEqual({category: int(scores[i]) for category, scores in batch.items()}, if_chain_scores(f))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Threshold search for the image scoring rules, scored against user feedback.
+
+Feedback linked to a classification is a label: "Correct" means the category the user was shown was
+right, "Incorrect" that it was wrong, and an Incorrect message naming a category ("should be compost")
+says which one was right. Candidate thresholds are scored on the stored features of those
+classifications, thousands of threshold sets per NumPy pass, spread over a process pool.
+
+    python cli.py tune --samples 20000 --output rules.json
+    python cli.py --rules rules.json classify-dir ...
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+import classifier
+from classifier import CATEGORIES, ImageFeatures
+from feature_store import features_of, keyword_hits_of
+
+# word stems that name a category in a feedback message
+CATEGORY_STEMS = {
+    "Recyclable": ("recycl",),
+    "Reusable": ("reus",),
+    "Compostable": ("compost", "organic"),
+    "Trash": ("trash", "garbage", "rubbish", "landfill"),
+}
+
+# threshold sets x labels scored in one array pass, the (K, N, 4) score arrays stay around 8 MiB
+PASS_ELEMENTS = 1 << 18
+
+
+class FeedbackLabels(NamedTuple):
+    features: ImageFeatures  # fields are length N arrays
+    hits: np.ndarray         # (N, 4) stored keyword hits
+    judged: np.ndarray       # category index the user was shown
+    correct: np.ndarray      # bool, the user said it was right
+    named: np.ndarray        # category index named in the message, -1 if none
+
+
+def named_category(message):
+    text = (message or "").lower()
+    named = [i for i, category in enumerate(CATEGORIES) if any(stem in text for stem in CATEGORY_STEMS[category])]
+    return named[0] if len(named) == 1 else -1
+
+def load_labels(db, store):
+    """FeedbackLabels for every piece of feedback whose classification has stored features"""
+    rows = db.execute("SELECT history_id, type, message, judged_category FROM feedback "
+                      "WHERE history_id IS NOT NULL AND judged_category IN (?, ?, ?, ?)", CATEGORIES).fetchall()
+    records = store.records()
+    ids = np.asarray(records["history_id"])
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+
+    wanted = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+    # the last record for an id wins, in case a row was ever stored twice
+    pos = np.searchsorted(sorted_ids, wanted, side="right") - 1
+    found = (pos >= 0) & (sorted_ids[np.maximum(pos, 0)] == wanted) if len(sorted_ids) else np.zeros(len(rows), bool)
+    block = np.asarray(records[order[pos[found]]]) if found.any() else np.zeros(0, records.dtype)
+    rows = [row for row, ok in zip(rows, found) if ok]
+
+    return FeedbackLabels(
+        features=features_of(block),
+        hits=keyword_hits_of(block),
+        judged=np.array([CATEGORIES.index(row[3]) for row in rows], np.int64),
+        correct=np.array([row[1] == "Correct" for row in rows], bool),
+        named=np.array([named_category(row[2]) if row[1] != "Correct" else -1 for row in rows], np.int64),
+    )
+
+def agreement(best, labels):
+    """Share of labels a prediction (N,) or (K, N) agrees with, per threshold set"""
+    ok = np.where(labels.named >= 0, best == labels.named,
+                  np.where(labels.correct, best == labels.judged, best != labels.judged))
+    return ok.mean(axis=-1)
+
+
+# ---- CANDIDATES ----
+
+def random_configs(rules, samples, spread=0.5, params=None, seed=0):
+    """{param: (samples,) thresholds}, each drawn uniformly within +-spread of its current value"""
+    rng = np.random.default_rng(seed)
+    configs = {}
+    for param in params or rules.params:
+        current = rules.params[param]
+        low, high = (current * (1 - spread), current * (1 + spread)) if current else (0.0, spread)
+        configs[param] = rng.uniform(low, high, samples)
+    return configs
+
+def grid_configs(grid):
+    """{param: (K,) thresholds} covering every combination of the values in grid {param: [values]}"""
+    params = list(grid)
+    combos = np.array(list(itertools.product(*(grid[param] for param in params))), dtype=np.float64)
+    return {param: combos[:, i] for i, param in enumerate(params)}
+
+def config_count(configs):
+    return len(next(iter(configs.values()))) if configs else 0
+
+
+# ---- SEARCH ----
+
+_labels = None
+
+def _init_worker(labels, *initargs):
+    # the labels are the same for every chunk, each process gets them once
+    global _labels
+    classifier.init_worker(*initargs)
+    _labels = labels
+
+def _score_configs(configs):
+    # one chunk of threshold sets, in a pool process
+    total = config_count(configs)
+    accuracy = np.empty(total)
+    step = max(1, PASS_ELEMENTS // max(len(_labels.judged), 1))
+    for start in range(0, total, step):
+        thresholds = {param: values[start:start + step, None] for param, values in configs.items()}
+        _, best = classifier.score_features_matrix(_labels.features, _labels.hits, thresholds)
+        accuracy[start:start + step] = agreement(best, _labels)
+    return accuracy
+
+def search(labels, configs, workers=None, chunk=2048):
+    """Agreement with the feedback labels for every threshold set in configs, scored across a process pool"""
+    total = config_count(configs)
+    chunks = [{param: values[start:start + chunk] for param, values in configs.items()}
+              for start in range(0, total, chunk)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_worker,
+                             initargs=(labels, *classifier.worker_initargs())) as pool:
+        results = list(pool.map(_score_configs, chunks))
+    return np.concatenate(results) if results else np.zeros(0)
+
+def baseline(labels):
+    """Agreement of the rules as they are now"""
+    if not len(labels.judged):
+        return 0.0
+    _, best = classifier.score_features_matrix(labels.features, labels.hits)
+    return float(agreement(best, labels))
+
+def best_configs(configs, accuracy, top=5):
+    """[(accuracy, {param: threshold}), ...] for the top threshold sets"""
+    ranked = np.argsort(-accuracy, kind="stable")[:top]
+    return [(float(accuracy[i]), {param: float(values[i]) for param, values in configs.items()}) for i in ranked]
@@ -0,0 +1,196 @@
+"""Conveyor-belt video classification: python cli.py classify-video <file> ...
+
+Only a few frames per second are sampled: every frame is grab()bed, which just advances the decoder, and
+only the sampled ones are retrieve()d, colour converted and shrunk to the classifier resolution. Sampled
+frames go through the vectorized feature and scoring path in batches.
+
+Items are found against a running picture of the empty belt: a frame differs from it while something is
+in view. The recording is assumed to start on an empty belt. Per-frame probabilities are averaged over a
+sliding window within each item, and a change in the smoothed category that lasts splits two touching
+items. Each item becomes one history row.
+"""
+from collections import deque
+
+import cv2
+import numpy as np
+
+from classifier import CATEGORIES, CLASSIFY_SIZE, extract_features_batch, keyword_hit_matrix, score_features_matrix
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".webm", ".m4v", ".mpg", ".mpeg")
+
+SAMPLE_FPS = 5.0
+SMOOTH_WINDOW = 5       # sampled frames averaged per smoothed estimate
+MIN_ITEM_SECONDS = 0.8  # shorter detections are noise, and a category change must last this long to split
+MAX_GAP_SAMPLES = 1     # missed detections tolerated inside one item
+BATCH_FRAMES = 16
+
+# presence detection compares a small blurred colour thumbnail with the empty belt
+PRESENCE_SIZE = 64
+DIFF_THRESHOLD = 25     # change in any B, G or R level that counts as a changed pixel
+PRESENCE_RATIO = 0.05   # share of changed pixels that means something is in view
+BACKGROUND_RATE = 0.05  # how fast the empty-belt picture follows lighting changes
+
+
+def sample_frames(path, sample_fps=SAMPLE_FPS, target=CLASSIFY_SIZE, stats=None):
+    """Yield (seconds, frame) for sample_fps frames per second of video, each resized to target x target"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"cannot open video {path}")
+    # some containers don't record a frame rate
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    step = max(1, round(fps / sample_fps)) if sample_fps > 0 else 1
+    index = 0
+    try:
+        while capture.grab():
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    # INTER_AREA averages like the reduced JPEG decode stills go through
+                    yield index / fps, cv2.resize(frame, (target, target), interpolation=cv2.INTER_AREA)
+                    if stats is not None:
+                        stats["sampled"] += 1
+            index += 1
+    finally:
+        capture.release()
+        if stats is not None:
+            stats["frames"] += index
+            stats["video_seconds"] += index / fps
+
+
+class BeltBackground:
+    """Running estimate of the empty belt, update(frame) says whether something is in view"""
+
+    def __init__(self, presence_ratio=PRESENCE_RATIO):
+        self.presence_ratio = presence_ratio
+        self.background = None
+
+    def update(self, frame):
+        # presence_ratio 0 turns detection off: the whole video is one stream, split only by category
+        if self.presence_ratio <= 0:
+            return True
+        # colour, not grey: a green bottle on a grey belt can have the belt's luminance
+        small = cv2.resize(frame, (PRESENCE_SIZE, PRESENCE_SIZE), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0).astype(np.float32)
+        if self.background is None:
+            self.background = small
+            return False
+
+        # a pixel changed when any one channel moved past the threshold
+        diff = cv2.absdiff(small, self.background).max(axis=2)
+        changed = float(np.count_nonzero(diff > DIFF_THRESHOLD)) / diff.size
+        present = changed > self.presence_ratio
+        if not present:
+            # only the empty belt is learned, an item that stops in view never becomes background
+            cv2.accumulateWeighted(small, self.background, BACKGROUND_RATE)
+        return present
+
+
+def _percentages(mean):
+    # same rounding as normalize_scores: the first three truncated, Trash takes the remainder
+    percents = [int(p) for p in mean[:3]]
+    return dict(zip(CATEGORIES, percents + [100 - sum(percents)]))
+
+
+class ItemTracker:
+    """Turns the stream of (seconds, present, smoothed percentages) samples into items"""
+
+    def __init__(self, min_samples, max_gap=MAX_GAP_SAMPLES):
+        self.min_samples = min_samples
+        self.max_gap = max_gap
+        self.items = []
+        self.current = None  # [(seconds, percents), ...] of the item in view
+        self.category = None
+        self.pending = []    # samples disagreeing with self.category, a new item if they last
+        self.gap = 0
+
+    def add(self, seconds, present, smoothed):
+        if not present:
+            self.gap += 1
+            if self.current is not None and self.gap > self.max_gap:
+                self.close()
+            return
+        self.gap = 0
+
+        category = int(np.argmax(smoothed))
+        if self.current is None:
+            self.current, self.category = [(seconds, smoothed)], category
+        elif category == self.category:
+            # a short disagreement was noise, keep it as part of this item
+            self.current += self.pending + [(seconds, smoothed)]
+            self.pending = []
+        else:
+            self.pending.append((seconds, smoothed))
+            run = 0
+            for _, percents in reversed(self.pending):
+                if int(np.argmax(percents)) != category:
+                    break
+                run += 1
+            if run >= self.min_samples:
+                head, tail = self.current + self.pending[:-run], self.pending[-run:]
+                self.pending = []
+                if len(head) < self.min_samples:
+                    # the first frames of an item sliding into view, still mostly belt
+                    self.current, self.category = head + tail, category
+                else:
+                    # two items touching on the belt: the new one starts where its category took over
+                    self.current = head
+                    self.close()
+                    self.current, self.category = tail, category
+
+    def close(self):
+        samples = self.current + self.pending if self.current else []
+        self.current, self.category, self.pending = None, None, []
+        if len(samples) < self.min_samples:
+            return
+        mean = np.mean([percents for _, percents in samples], axis=0)
+        probabilities = _percentages(mean)
+        self.items.append({
+            "start": samples[0][0],
+            "end": samples[-1][0],
+            "samples": len(samples),
+            "probabilities": probabilities,
+            "category": max(probabilities, key=probabilities.get),
+        })
+
+
+def classify_video(path, description="", sample_fps=SAMPLE_FPS, window=SMOOTH_WINDOW,
+                   min_seconds=MIN_ITEM_SECONDS, presence_ratio=PRESENCE_RATIO, batch_frames=BATCH_FRAMES):
+    """Classify the items passing through a video.
+
+    Returns (items, stats): items are dicts with start/end seconds, the number of samples and the
+    averaged probabilities and category; stats counts frames decoded and sampled and the video length.
+    """
+    stats = {"frames": 0, "sampled": 0, "video_seconds": 0.0}
+    hits = keyword_hit_matrix([description])  # (1, 4), broadcasts over every frame
+    background = BeltBackground(presence_ratio)
+    tracker = ItemTracker(max(1, round(min_seconds * sample_fps)) if sample_fps > 0 else 1)
+    recent = deque(maxlen=max(1, window))
+
+    batch = []
+    frames = sample_frames(path, sample_fps, stats=stats)
+    while True:
+        sample = next(frames, None)
+        if sample is not None:
+            batch.append(sample)
+            if len(batch) < batch_frames:
+                continue
+        if batch:
+            percents, _ = score_features_matrix(extract_features_batch(np.stack([frame for _, frame in batch])), hits)
+            for (seconds, frame), frame_percents in zip(batch, percents):
+                present = background.update(frame)
+                if present:
+                    recent.append(frame_percents)
+                else:
+                    # smoothing never mixes the empty belt, or the previous item, into an item
+                    recent.clear()
+                tracker.add(seconds, present, np.mean(recent, axis=0) if present else None)
+            batch = []
+        if sample is None:
+            break
+    tracker.close()
+    return tracker.items, stats
+
+
+def format_clock(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(minutes):02d}:{seconds:04.1f}"